@@ -1,16 +1,21 @@
 """
-- get_db() for a request SQLAlchemy Session
+- get_db() for a request SQLAlchemy Session, shared by every router so a request uses one session
 - get_current_user() to enforce JWT auth and fetch the User
+
+Tokens verified recently skip the signature check and the user SELECT (services/auth_cache.py):
+the cached snapshot becomes a User in the request's session without touching the DB.
 """
 from typing import Generator
 from datetime import datetime, timezone
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+from sqlalchemy.orm import make_transient_to_detached
 
 from app.db import SessionLocal
 from app.models import User
 from app.config import settings
+from app.services.auth_cache import verified_tokens
 
 # Reusable HTTP bearer (reads Authorization: Bearer <token>)
 bearer_scheme = HTTPBearer(auto_error=True)
@@ -30,6 +35,15 @@ def get_current_user(
 ) -> User:
     # verifies the JWT, loads user from the db, and then runs checks to see if the user is valid
     token = creds.credentials
+
+    snapshot = verified_tokens.get(token)
+    if snapshot is not None:
+        # same row as a db.get() would give, minus the query
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        db.add(user)
+        return user
+
     try:
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
     except jwt.PyJWTError:
@@ -49,4 +63,5 @@ def get_current_user(
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    verified_tokens.put(token, user, exp_ts)
     return user
@@ -13,13 +13,42 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./trailblazer.db"
+    DB_ASYNC: bool = False # hot read routes use an async engine (needs aiosqlite / asyncpg)
+    DB_POOL_SIZE: int = 10 # connections kept open per engine
+    DB_MAX_OVERFLOW: int = 10 # extra connections allowed under load, closed again when returned
+    DB_POOL_TIMEOUT: float = 30 # seconds a request waits for a free connection before erroring
     JWT_SECRET: str = "secret-token-in-env" # overrides in .env 
     JWT_ALG: str = "HS256" # algorithm to sign tokens with
     JWT_EXPIRE_MINUTES: int = 60 * 24 * 7 # 7 days
+    PASSWORD_HASH_ROUNDS: int = 29000 # pbkdf2_sha256 cost, hashes with other rounds are redone on login
+    PASSWORD_HASH_WORKERS: int = 2 # processes doing password hashing, 0 = hash in the request thread
+    PASSWORD_HASH_MAX_PENDING: int = 16 # more password operations than this at once get a 503
+    RATE_LIMIT_LOGIN_WINDOW_SECONDS: float = 15 * 60 # failed logins are counted over this sliding window
+    RATE_LIMIT_LOGIN_PER_IP: int = 30 # failed logins per window from one IP, 0 = no limit
+    RATE_LIMIT_LOGIN_PER_EMAIL: int = 5 # failed logins per window for one account, 0 = no limit
+    RATE_LIMIT_BACKEND: str = "memory" # "memory" (per process) or "sqlite" (shared by workers on one machine)
+    RATE_LIMIT_SQLITE_PATH: str = "ratelimit.db"
+    AUTH_CACHE_SIZE: int = 10_000 # verified tokens kept in memory, 0 = verify every request
+    AUTH_CACHE_TTL_SECONDS: float = 300 # how long a verified token is trusted without checking again
     CORS_ALLOW_ORIGINS: str = "*"
 
     NPS_API_KEY: str | None = None
 
+    UPLOAD_MAX_BYTES: int = 15 * 1024 * 1024 # biggest photo we accept (15 MB)
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024 # uploads are streamed to disk this much at a time
+    PHOTO_VARIANT_WORKERS: int = 2 # processes making thumb/card/full copies of photos, 0 = off
+
+    BASEMAP_MBTILES: str | None = None # local base map extract the offline tile packs are cut from, unset = no offline maps
+    TILE_PACK_BUFFER_KM: float = 5 # map area kept around a saved trail
+    TILE_PACK_MIN_ZOOM: int = 10
+    TILE_PACK_MAX_ZOOM: int = 15
+
+    FEED_FANOUT_MAX_FOLLOWERS: int = 5000 # posts of accounts with more followers are merged into feeds on read
+    FEED_BACKFILL_POSTS: int = 50 # recent posts copied into your feed when you follow someone
+
+    RATINGS_RECONCILE_MINUTES: float = 60 # how often trail rating totals are checked against reviews, 0 = off
+    CHANGE_LOG_RETENTION_DAYS: float = 30 # offline sync tokens older than this get a full resync, 0 = keep forever
+
     class Config:
         env_file = ".env"
 
@@ -3,22 +3,47 @@ Starts up our database for Trailblazer.
 
 - Creates a SQLAlchemy Engine (SQLite file by default), Alchemy allows python objects to be mapped to the sqllite db 
 - Enables useful SQLite PRAGMAs (foreign_keys + WAL(read and write))
+- Sizes the connection pool from settings (DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT)
+  and counts checkouts into the metrics (services/db_pool.py)
 - Starts a SessionLocal for our db to run
 - Maps our Python classes to db models 
+- Optionally (settings.DB_ASYNC) an async engine on the same database for the hot read routes, see run_read()
+  and offload()
 """
 
+from contextvars import ContextVar
+
 from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
-import os
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.services.db_pool import watch
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./trailblazer.db")
+# from settings like DB_ASYNC, so an env var and a .env file both work for either
+DATABASE_URL = settings.DATABASE_URL
 
 # SQLite needs this connect arg in multi-threaded apps like FastAPI’s dev server.
 connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 
 
+
+def _pool_args(url: str) -> dict:
+    # an in-memory SQLite db lives in one connection, its pool can't be sized
+    if ":memory:" in url or url.rstrip("/").endswith("sqlite:"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
+
 # alchemy engine manages db connections
-engine = create_engine(DATABASE_URL, connect_args=connect_args, future=True)
+engine = create_engine(DATABASE_URL, connect_args=connect_args, future=True, **_pool_args(DATABASE_URL))
+watch(engine)
 
 
 
@@ -45,3 +70,83 @@ SessionLocal = sessionmaker(
 
 # All ORM models should inherit from this Base:
 Base = declarative_base()
+
+
+# Async engine: aiosqlite for SQLite, asyncpg for Postgres. Off unless DB_ASYNC is set and the driver is installed.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+
+
+def _async_url(url: str) -> str | None:
+    # same database, async driver (postgresql+psycopg2://... -> postgresql+asyncpg://...)
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        return None
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC and _async_url(DATABASE_URL):
+    try:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+        async_args = _pool_args(DATABASE_URL)
+        if async_args:
+            async_args["poolclass"] = AsyncAdaptedQueuePool  # aiosqlite would default to no pooling at all
+        async_engine = create_async_engine(_async_url(DATABASE_URL), future=True, **async_args)
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        watch(async_engine.sync_engine)
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    except ImportError:  # driver not installed, stay sync
+        async_engine = AsyncSessionLocal = None
+
+
+# set while a run_read function runs on the event loop (async engine), see offload()
+_on_event_loop: ContextVar[bool] = ContextVar("_on_event_loop", default=False)
+
+
+async def run_read(fn, *args, **kwargs):
+    """
+    Run fn(db, *args, **kwargs), a normal sync function using a Session, from an async route.
+    With the async engine it runs through AsyncSession.run_sync, so waiting on the DB never
+    holds a thread; otherwise it runs in the threadpool with a SessionLocal session like a
+    sync route would. Meant for read-only work: nothing is committed.
+    On the async engine fn runs on the event loop, so its CPU heavy parts go through offload().
+    """
+    if AsyncSessionLocal is not None:
+        def on_loop(session, *args, **kwargs):
+            token = _on_event_loop.set(True)
+            try:
+                return fn(session, *args, **kwargs)
+            finally:
+                _on_event_loop.reset(token)
+
+        async with AsyncSessionLocal() as session:
+            return await session.run_sync(on_loop, *args, **kwargs)
+
+    def call():
+        with SessionLocal() as db:
+            return fn(db, *args, **kwargs)
+
+    return await run_in_threadpool(call)
+
+
+def offload(fn, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs) from a run_read function: CPU work like distance math or serializing
+    a page. On the event loop (async engine) it runs in the threadpool instead, so other requests
+    keep being served meanwhile; otherwise fn is already on a threadpool thread and runs directly.
+    fn must not use the session.
+    """
+    if _on_event_loop.get():
+        return await_only(run_in_threadpool(_off_loop, fn, args, kwargs))
+    return fn(*args, **kwargs)
+
+
+def _off_loop(fn, args, kwargs):
+    # run_in_threadpool copies the context, an offload() inside fn must not wait on the loop again
+    _on_event_loop.set(False)
+    return fn(*args, **kwargs)
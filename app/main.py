@@ -14,8 +14,20 @@ from fastapi.staticfiles import StaticFiles  # where we have images
 from fastapi.middleware.cors import CORSMiddleware  # Allow mobile app to call API
 
 
-from app.db import engine, Base  # SQLAlchemy engine + declarative Base
-from app.routers import trails, auth, parks, notes, favorites, nps_admin, activities, profiles, posts, offline # Feature router for all endpoints
+from app.db import engine, async_engine, Base, SessionLocal  # SQLAlchemy engine + declarative Base
+from app.services.geo import backfill_trail_cells
+from app.services.search import ensure_search_index
+from app.services.schema_upgrade import upgrade_schema
+from app.services.trigram import build_name_indexes
+from app.services.autocomplete import name_suggestions
+from app.services.pagination import NEXT_CURSOR_HEADER
+from app.services.ratings import start_reconciler
+from app.services.changes import start_pruner
+from app.services import metrics, passwords, photo_variants
+from app.services.media import MediaFiles, UploadSizeLimit
+from app.services.db_pool import RequestCheckouts, pool_status
+from app.config import settings
+from app.routers import trails, auth, parks, notes, favorites, nps_admin, activities, profiles, posts, offline, feed # Feature router for all endpoints
 
 #App initialization
 
@@ -30,18 +42,33 @@ app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # Create all database tables on startup
 Base.metadata.create_all(bind=engine)
+# create_all skips existing tables, so columns/indexes added since a db was created come from here
+upgrade_schema(engine)
+
+# Trails saved before the spatial grid existed still need their cell filled in
+with SessionLocal() as _db:
+    backfill_trail_cells(_db)
+    build_name_indexes(_db) # in-memory trigram indexes for fuzzy search
+    name_suggestions.build(_db) # autocomplete list, so no request has to build it
+
+# FTS5 table + triggers behind /trails/search (no-op outside SQLite)
+ensure_search_index(engine)
 
 
 # CORS so React Native app can talk to this API during development
 
 
+# 413 for oversized photo uploads before the form is spooled to disk (added before CORS so CORS wraps it)
+app.add_middleware(UploadSizeLimit, max_bytes=settings.UPLOAD_MAX_BYTES, path_pattern=r"/trails/\d+/photos")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER], # next page cursor for paginated lists
 )
+app.add_middleware(RequestCheckouts) # db connections used per request, shown in /metrics
 
 
 # Routers
@@ -65,6 +92,7 @@ app.include_router(activities.router)
 app.include_router(profiles.router)
 app.include_router(posts.router)
 app.include_router(offline.router)
+app.include_router(feed.router)
 
 
 # Static files for uploading images
@@ -74,7 +102,20 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 
 os.makedirs("media", exist_ok=True) # media directory has to exist for the photos
-app.mount("/media", StaticFiles(directory="media"), name="media")
+app.mount("/media", MediaFiles(directory="media"), name="media")  # blobs/ served as immutable
+
+
+# background job that checks trail rating totals against the reviews table
+@app.on_event("startup")
+def start_background_jobs():
+    start_reconciler(SessionLocal, settings.RATINGS_RECONCILE_MINUTES)
+    start_pruner(SessionLocal, settings.CHANGE_LOG_RETENTION_DAYS) # change log behind /offline/sync
+
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    photo_variants.shutdown() # worker processes for photo thumbnails
+    passwords.shutdown() # worker processes for password hashing
 
 
 # check to verify the API is up
@@ -83,6 +124,16 @@ def health():
     return {"status": "ok", "service": "trailblazer"}
 
 
+# timings and counters of this process (password hashing, db connections, ...), see services/metrics.py
+@app.get("/metrics")
+def get_metrics():
+    snapshot = metrics.snapshot()
+    snapshot["db_pool"] = pool_status(engine)
+    if async_engine is not None:
+        snapshot["db_pool_async"] = pool_status(async_engine.sync_engine)
+    return snapshot
+
+
 """
 Still have to add:
 - parks
@@ -14,9 +14,14 @@ Later we can add:
 """
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, Float, Text, Boolean, ForeignKey, CheckConstraint, DateTime, func, UniqueConstraint
+from sqlalchemy import String, Integer, Float, Text, Boolean, ForeignKey, CheckConstraint, DateTime, func, UniqueConstraint, Index, JSON, event, text, true
 from .db import Base
-from datetime import datetime #for photos when photos get uploaded
+from .services.geo import cell_id
+from datetime import datetime, timezone #for photos when photos get uploaded
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 class User(Base): # actual creation of a user comes in auth
@@ -34,6 +39,9 @@ class User(Base): # actual creation of a user comes in auth
     # Display name -- CookinUpMemez would be tuff here
     display_name: Mapped[str] = mapped_column(String)
 
+    # kept up to date by the follow toggle, decides between fan-out on write and on read (services/feed.py)
+    followers_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+
     notes: Mapped[list["Note"]] = relationship(back_populates="user", cascade="all, delete-orphan")
 
     favorites: Mapped[list["Favorite"]] = relationship(back_populates="user", cascade="all, delete-orphan")
@@ -68,6 +76,9 @@ class Park(Base):
     lat: Mapped[float | None] = mapped_column(Float, nullable=True)
     lon: Mapped[float | None] = mapped_column(Float, nullable=True)
 
+    # lets the nearby bounding box prefilter use an index range on lat
+    __table_args__ = (Index("ix_parks_lat_lon", "lat", "lon"),)
+
 
 
 class Trail(Base):
@@ -97,9 +108,14 @@ class Trail(Base):
     lat: Mapped[float | None] = mapped_column(Float, nullable=True)
     lon: Mapped[float | None] = mapped_column(Float, nullable=True)
 
+    # Spatial grid cell of (lat, lon), see services/geo.py -- kept in sync by _set_trail_cell below
+    geo_cell: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+
     # will add this to the parks as well later
     avg_rating: Mapped[float] = mapped_column(Float, default=0)
     ratings_count: Mapped[int] = mapped_column(Integer, default=0)
+    # running total of all ratings, so a new review updates avg/count without re-reading every review
+    rating_sum: Mapped[float] = mapped_column(Float, default=0)
 
     # Create a relationship bc a trail has many reviews -- also add this to the parks as well
     reviews: Mapped[list["Review"]] = relationship(
@@ -117,6 +133,32 @@ class Trail(Base):
 
     offline_downloads: Mapped[list["OfflineDownload"]] = relationship(back_populates="trail", cascade="all, delete-orphan")
 
+    # for the filters on /trails/ and /trails/filter: difficulty (best rated first), the ranges, and
+    # partial indexes holding only the trails that have a feature, so those filters read just them
+    __table_args__ = (
+        Index("ix_trails_difficulty_rating", "difficulty", "avg_rating"),
+        Index("ix_trails_length_km", "length_km"),
+        Index("ix_trails_elevation_gain_m", "elevation_gain_m"),
+        Index("ix_trails_accessible", "id", sqlite_where=text("accessible = 1"), postgresql_where=text("accessible")),
+        Index("ix_trails_has_waterfall", "id", sqlite_where=text("has_waterfall = 1"), postgresql_where=text("has_waterfall")),
+        Index("ix_trails_has_viewpoint", "id", sqlite_where=text("has_viewpoint = 1"), postgresql_where=text("has_viewpoint")),
+    )
+
+
+
+# keep the grid cell up to date whenever a trail is written through the ORM
+@event.listens_for(Trail, "before_insert")
+@event.listens_for(Trail, "before_update")
+def _set_trail_cell(mapper, connection, target: Trail) -> None:
+    target.geo_cell = cell_id(target.lat, target.lon)
+
+
+# trails seeded with an avg_rating/ratings_count (populate scripts) start with the matching sum
+@event.listens_for(Trail, "before_insert")
+def _seed_rating_sum(mapper, connection, target: Trail) -> None:
+    if target.rating_sum is None:
+        target.rating_sum = (target.avg_rating or 0) * (target.ratings_count or 0)
+
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -131,9 +173,18 @@ class Review(Base):
     rating: Mapped[int] = mapped_column(Integer)
     body: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # set by the app too (not only the db default), so SQLite stores it in the same text format the
+    # page cursors are compared in: CURRENT_TIMESTAMP has no fractions, SQLAlchemy's format does
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, server_default=func.now(), nullable=False)
+
 
     # Make sure we only have 1-5 right now, will function as just buttons later
-    __table_args__ = (CheckConstraint("rating BETWEEN 1 AND 5"),)
+    # the indexes serve the Recent (newest first) and Popular (best rated first) review pages of a trail
+    __table_args__ = (
+        CheckConstraint("rating BETWEEN 1 AND 5"),
+        Index("ix_reviews_trail_created", "trail_id", "created_at"),
+        Index("ix_reviews_trail_rating_created", "trail_id", "rating", "created_at"),
+    )
 
     # Relationship back to trail
     trail: Mapped["Trail"] = relationship(back_populates="reviews")
@@ -145,6 +196,9 @@ class Photos(Base):
     trail_id: Mapped[int] = mapped_column(ForeignKey("trails.id"), index=True, nullable=False) # photos need a trail, nullable=False bc we need it 
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True, nullable=False) # photos need a user 
     file_path: Mapped[str] = mapped_column(String, nullable=False) # stored in a path
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True) # sha256 of the file
+    size_bytes: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    variants: Mapped[dict | None] = mapped_column(JSON, nullable=True) # resized copies, {"thumb": path, "card": path, "full": path}
     caption: Mapped[str] = mapped_column(Text, nullable=True) # caption for the photo
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False) # the time when the photo was uploaded
 
@@ -231,12 +285,21 @@ class Post(Base):
     title: Mapped[str | None] = mapped_column(String, nullable=True)
     body: Mapped[str] = mapped_column(Text, nullable=False)
 
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # set by the app like Review.created_at, it's a page cursor key too
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
+    # False when the author had too many followers to copy it into their timelines (services/feed.py),
+    # feeds then merge it in on read
+    fanned_out: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true(), nullable=False)
+
     user: Mapped["User"] = relationship(back_populates="posts")
     trail: Mapped["Trail"] = relationship(back_populates="posts")
 
+    __table_args__ = (
+        Index("ix_posts_not_fanned_out", "user_id", "id", sqlite_where=text("fanned_out = 0"), postgresql_where=text("NOT fanned_out")),
+    )
+
 
 
 class OfflineDownload(Base):
@@ -254,3 +317,56 @@ class OfflineDownload(Base):
 
     __table_args__ = (
         UniqueConstraint("user_id", "trail_id", name="uq_offline_user_trail"),)
+
+
+class Follow(Base):
+    # follower_id follows followee_id
+    __tablename__ = "follows"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+
+    follower_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    followee_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("follower_id", "followee_id", name="uq_follow_pair"),)
+
+
+class FeedEntry(Base):
+    # one post in one user's Friends timeline, written when the post is created (fan-out on write)
+    __tablename__ = "feed_entries"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE")) # whose timeline
+    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id", ondelete="CASCADE"), index=True)
+    author_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE")) # to drop entries on unfollow
+
+    __table_args__ = (
+        # a timeline page is one range read of this index, newest post first
+        UniqueConstraint("user_id", "post_id", name="uq_feed_user_post"),
+        Index("ix_feed_user_author", "user_id", "author_id"),
+    )
+
+
+class ChangeLog(Base):
+    # one row per insert/update/delete of a synced row, written by the hooks in services/changes.py
+    __tablename__ = "change_log"
+
+    # the sync token handed to clients is the last seq they saw, so it must never be reused
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    entity: Mapped[str] = mapped_column(String(32), nullable=False) # table name of the changed row
+    row_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # no foreign keys: the rows may be gone already
+    trail_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    user_id: Mapped[int | None] = mapped_column(Integer, nullable=True) # owner, for private rows (notes, offline saves)
+    deleted: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    changed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_change_log_trail_seq", "trail_id", "seq"),
+        Index("ix_change_log_user_seq", "user_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
@@ -7,32 +7,23 @@ Endpoints:
 - GET/progress/me (averages the stats for the user)
 """
 
-from typing import Generator, List, Optional
+from typing import List, Optional
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from app.db import SessionLocal
 from app.models import Activity, Trail, User
 from app import schemas
 
 
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
 
 
 router = APIRouter(prefix="", tags=["activities"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.post(
     "/trails/{trail_id}/activities",
     response_model=schemas.ActivityOut,
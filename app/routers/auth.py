@@ -6,33 +6,28 @@ Authentication:
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from pydantic import BaseModel, EmailStr, Field
-from passlib.context import CryptContext # kept getting password is not 72 bytes error so hope this helps instead
 import jwt
 
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
 from app.models import User
 from app.config import settings
 from app.callback import get_db, get_current_user
+from app.services.passwords import HashingBusy, hash_password, verify_and_update, verify_password
+from app.services.rate_limit import RateLimited, check_login, login_succeeded
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-pwd_context = CryptContext( # password hashing with cryptcontext
-    schemes=["pbkdf2_sha256"],
-    deprecated="auto",
-)
-
-
-
-def hash_password(plain: str) -> str:
-    return pwd_context.hash(plain)
-
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+# password hashing (pbkdf2_sha256) runs in a worker pool, see services/passwords.py
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-ins right now, try again in a moment",
+        headers={"Retry-After": "1"},
+    )
 
 
 def create_access_token(*, user_id: int) -> str:
@@ -79,14 +74,6 @@ class PasswordChange(BaseModel):
     new_password: str = Field(min_length=6, max_length=100)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 def create_access_token(*, user_id: int) -> str:
     now = datetime.now(tz=timezone.utc)
     exp = now + timedelta(minutes=settings.JWT_EXPIRE_MINUTES)
@@ -105,9 +92,14 @@ def register(data: RegisterIn, db: Session = Depends(get_db)):
     if db.query(User).filter(User.email == data.email).first():
         raise HTTPException(status_code=400, detail="Email already registered")
 
+    try:
+        password_hash = hash_password(data.password)
+    except HashingBusy:
+        raise _busy()
+
     user = User(
         email=data.email,
-        password_hash=hash_password(data.password),
+        password_hash=password_hash,
         display_name=data.display_name,
     )
     db.add(user)
@@ -119,10 +111,32 @@ def register(data: RegisterIn, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=TokenOut)
-def login(data: LoginIn, db: Session = Depends(get_db)):
+def login(data: LoginIn, request: Request, db: Session = Depends(get_db)):
+    # counted per IP and per email before any DB or hashing work, taken back if the password
+    # is right, so only failed logins count (services/rate_limit.py)
+    ip = request.client.host if request.client else None
+    try:
+        counted_at = check_login(ip, data.email)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
     user = db.query(User).filter(User.email == data.email).first()
-    if not user or not verify_password(data.password, user.password_hash): # if email not found or invalid password
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        ok, new_hash = verify_and_update(data.password, user.password_hash)
+    except HashingBusy:
+        raise _busy()
+    if not ok: # invalid password
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    login_succeeded(ip, data.email, counted_at)
+    if new_hash: # stored with an old hash cost, upgrade it now that we know the password
+        user.password_hash = new_hash
+        db.commit()
     token = create_access_token(user_id=user.id)
     return TokenOut(access_token=token)
 
@@ -137,10 +151,13 @@ def change_password(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    if not verify_password(payload.current_password, current_user.password_hash): # remember, the user is changing their password bc they want to, not bc they forgot it. 
-        raise HTTPException(status_code=400, detail="Current password is incorrect") # first, they need to provide their current password to be able to change it to a new one.
-    
-    current_user.password_hash = hash_password(payload.new_password)
+    try:
+        if not verify_password(payload.current_password, current_user.password_hash): # remember, the user is changing their password bc they want to, not bc they forgot it. 
+            raise HTTPException(status_code=400, detail="Current password is incorrect") # first, they need to provide their current password to be able to change it to a new one.
+
+        current_user.password_hash = hash_password(payload.new_password)
+    except HashingBusy:
+        raise _busy()
     db.add(current_user)
     db.commit()
     return
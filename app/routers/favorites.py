@@ -6,29 +6,20 @@ Endpoints:
 - GET/me/favorites (list current user's favorited trails)
 """
 
-from typing import Generator, List
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
 from app.models import Favorite, Trail, User
 from app import schemas
 
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
 
 
 router = APIRouter(prefix="", tags=["favorites"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.post(
     "/trails/{trail_id}/favorite",
     response_model=schemas.FavoriteStatusOut,
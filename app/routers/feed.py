@@ -0,0 +1,102 @@
+"""
+Follows and the Friends feed API router
+
+Endpoints:
+- POST/users/{user_id}/follow (toggle following a user, toggle it again to unfollow)
+- GET/feed/me (posts of the people you follow, newest first, cursor paginated via X-Next-Cursor)
+"""
+
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+
+from app.models import Follow, Post, User
+from app import schemas
+from app.routers.posts import AUTHOR_COLUMNS, post_out
+from app.services.feed import follow, timeline_post_ids, unfollow
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursor, decode_cursor, encode_cursor
+
+from app.callback import get_current_user, get_db
+
+
+router = APIRouter(prefix="", tags=["feed"])
+
+
+@router.post(
+    "/users/{user_id}/follow",
+    response_model=schemas.FollowStatusOut,
+)
+def toggle_follow(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    - If not following the user yet -> follow
+    - If already following -> unfollow
+    """
+    if user_id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You can't follow yourself")
+
+    followee = db.get(User, user_id)
+    if not followee:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    record = (
+        db.query(Follow.id)
+        .filter(Follow.follower_id == current_user.id, Follow.followee_id == user_id)
+        .first()
+    )
+
+    if record:
+        unfollow(db, current_user.id, user_id)  # a concurrent unfollow may have won, same result
+        db.commit()
+        return schemas.FollowStatusOut(is_following=False, message="Unfollowed")
+
+    try:
+        follow(db, current_user.id, followee)
+        db.commit()
+    except IntegrityError:
+        # a concurrent request followed first
+        db.rollback()
+    return schemas.FollowStatusOut(is_following=True, message="Following")
+
+
+@router.get(
+    "/feed/me",
+    response_model=List[schemas.PostOut],
+)
+def my_feed(
+    response: Response,
+    limit: int = Query(default=50, ge=1, le=200, description="Max number of posts to return"),
+    cursor: Optional[str] = Query(default=None, description="X-Next-Cursor header value from the previous page"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    The Friends feed: posts of everyone you follow, newest first
+    """
+    before = None
+    if cursor:
+        try:
+            (before,) = decode_cursor(cursor, 1, (int,))
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    ids = timeline_post_ids(db, current_user.id, before, limit + 1)
+    if len(ids) > limit:
+        ids = ids[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([ids[-1]])
+    if not ids:
+        return []
+
+    posts = (
+        db.query(Post)
+        .options(joinedload(Post.user).load_only(*AUTHOR_COLUMNS))
+        .filter(Post.id.in_(ids))
+        .order_by(Post.id.desc())
+        .all()
+    )
+    return [post_out(p) for p in posts]
@@ -10,29 +10,20 @@ Endpoints:
 Notes are private to each user. You can only see/edit/delete your own notes
 """
 
-from typing import Generator, List
+from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
 from app.models import Note, Trail, User
 from app import schemas
 
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
 
 
 router = APIRouter(prefix="", tags=["notes"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.get(
     "/trails/{trail_id}/notes",
     response_model=List[schemas.NoteOut],
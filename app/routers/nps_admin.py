@@ -8,31 +8,22 @@ Triggers a sync with the NPS API to insert parks into the db
 using the import_parks_by_states function from services/nps -> scripts/import_nps
 """
 
-from typing import Generator, Optional
+from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
 from app.models import User
 from app import schemas
 from app.services.nps import import_parks_by_states
 
 
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
 
 
 router = APIRouter(prefix="/admin/nps", tags=["nps-admin"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 def ensure_admin(user: User) -> None:
     """
     Ensures the user is authenticated
@@ -4,37 +4,38 @@ Offline downloads metadata API router
 Endpoints:
 - POST/offline/trails/{trail_id} (toggle offline save for current user)
 - GET/offline/trails (list trails saved for offline use)
+- GET/offline/bundle (one zip with all saved trails, parks, reviews, notes and thumbnails)
+- GET/offline/sync (what changed in the saved trails since the last sync)
+- GET/offline/trails/{trail_id}/tiles (map tile pack of a saved trail, built in the background when it is saved)
 """
 
-from typing import Generator, List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
 from app.models import OfflineDownload, Trail, User
 from app import schemas
 
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
+from app.services.http_cache import etag_matches
+from app.services.offline_bundle import get_bundle
+from app.services.offline_sync import sync
+from app.services.pagination import InvalidCursor, decode_cursor
+from app.services.tile_packs import build_tile_pack, is_building, pack_path
 
 
 router = APIRouter(prefix="/offline", tags=["offline"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.post(
     "/trails/{trail_id}",
     response_model=schemas.OfflineStatusOut,
 )
 def toggle_offline_trail(
     trail_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
@@ -74,6 +75,9 @@ def toggle_offline_trail(
     db.commit()
     db.refresh(new_record)
 
+    # cut the map tiles around the trail after the response went out
+    background_tasks.add_task(build_tile_pack, trail_id)
+
     return schemas.OfflineStatusOut(
         ok=True,
         is_offline=True,
@@ -101,3 +105,93 @@ def list_offline_trails(
     )
 
     return trails
+
+
+@router.get(
+    "/bundle",
+    response_class=FileResponse,
+    responses={200: {"content": {"application/zip": {}}}, 304: {"description": "Bundle unchanged"}},
+)
+def download_offline_bundle(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Everything saved for offline use in one zip: bundle.json (trails with park, top reviews,
+    your notes and photo info) plus thumbs/ with the photo thumbnails.
+    The zip is only rebuilt when something in it changed; send the ETag back as
+    If-None-Match to skip the download when your copy is current.
+    """
+    path, fingerprint = get_bundle(db, current_user.id)
+    etag = f'"{fingerprint}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="application/zip", filename="trailblazer-offline.zip", headers=headers)
+
+
+@router.get("/sync", response_model=schemas.OfflineSyncOut)
+def sync_offline_trails(
+    since: Optional[str] = Query(default=None, description="token from the previous sync, leave out for everything"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Changes to the trails saved for offline use since the 'since' token: changed or new rows
+    (trails, parks, reviews, your notes, photos) plus the ids of removed ones.
+    reset=true means the response is the full set and replaces the offline copy.
+    """
+    last_seq = None
+    if since:
+        try:
+            (last_seq,) = decode_cursor(since, 1, (int,))
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid sync token")
+    return sync(db, current_user.id, last_seq)
+
+
+@router.get(
+    "/trails/{trail_id}/tiles",
+    response_class=FileResponse,
+    responses={
+        200: {"content": {"application/x-sqlite3": {}}},
+        202: {"description": "Pack is still being built, try again later"},
+        304: {"description": "Pack unchanged"},
+    },
+)
+def download_trail_tiles(
+    trail_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    The offline map of a saved trail as one MBTiles file.
+    202 while the pack is being built (it starts when the trail is saved for offline use).
+    """
+    saved = (
+        db.query(OfflineDownload.id)
+        .filter(OfflineDownload.trail_id == trail_id, OfflineDownload.user_id == current_user.id)
+        .first()
+    )
+    trail = db.get(Trail, trail_id)
+    if not saved or not trail:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trail not saved for offline use")
+
+    path = pack_path(trail)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No offline map for this trail")
+
+    if not path.exists():
+        if not is_building(trail_id):
+            background_tasks.add_task(build_tile_pack, trail_id)  # e.g. saved before the base map was set up
+        return Response(status_code=status.HTTP_202_ACCEPTED, headers={"Retry-After": "10"})
+
+    etag = f'"{path.stem}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="application/x-sqlite3", filename=f"trail-{trail_id}.mbtiles", headers=headers)
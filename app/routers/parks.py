@@ -5,52 +5,39 @@ Endpoints:
 - GET /parks and filter with:
 - near="lat,lon"
 - radius=km
-- limit, offset
+- limit, cursor (keyset on (name, id), next cursor comes back in the X-Next-Cursor header)
+
+GET /parks/search?q= (name search, fuzzy=true for typo tolerant matching)
 
 GET /parks/{park_id}
 
 Notes:
-Uses haversine again for nearby parks
+Nearby parks are narrowed down with a bounding box in SQL, then distances are computed
+in one batch with the shared helpers in services/geo.py
 """
 
-from typing import Generator, List, Optional
-from math import radians, sin, cos, asin, sqrt
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 
 
-from app.db import SessionLocal
 from app.models import Park
 from app import schemas
+from app.db import offload, run_read
+from app.services.geo import bbox_filter, within_radius
+from app.services.trigram import park_names
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursor, after, decode_cursor, encode_cursor, scan_page
+from app.services.http_cache import PARK_CACHE, cached_json, json_response
 
 
 router = APIRouter(prefix="/parks", tags=["parks"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    # Create a new SQLAlchemy Session for this request and then close it after
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-# Haversine formula in KM for nearby filtering -- gets nearby between TWO points
-def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-   # Compute great circle distance between two (lat,lon) points in kilometers.
-    R = 6371.0 # this is earths radius
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    return 2 * R * asin(sqrt(a))
-
-
-
 @router.get("/", response_model=List[schemas.ParkOut])
 # response model is how our output is given from the schemas, i.e. after a link that is / -- the information of parks is outputted with the data we defined in schema for Park Out
-def list_parks(
+async def list_parks(
+    response: Response,
     near: Optional[str] = Query(
         default=None,
         description="Comma-separated 'lat,lon' to filter by nearby (e.g., '40.758,-73.9855').",
@@ -71,42 +58,96 @@ def list_parks(
     offset: int = Query(
         default=0,
         ge=0,
-        description="Number of parks to skip.",
+        deprecated=True,
+        description="Number of parks to skip. Use 'cursor' instead, it stays fast on deep pages.",
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="X-Next-Cursor header value from the previous page.",
     ),
-    db: Session = Depends(get_db),
 ):
+    """
+    Parks sorted by name. Pages are keyset based: pass the X-Next-Cursor header of a page
+    as 'cursor' to get the next one (no header = last page).
+    """
+    return await run_read(_list_parks, response, near, radius, limit, offset, cursor)
 
-    q = db.query(Park)
 
-    if not near:
-        return q.offset(offset).limit(limit).all()
+def _list_parks(db: Session, response: Response, near: Optional[str], radius: float, limit: int, offset: int, cursor: Optional[str]):
+    q = db.query(Park)
 
-    # Parse near="lat,lon"
-    try:
-        lat_s, lon_s = map(float, near.split(",")) # break up into the two different points of lat/lon
-    except Exception:
-        raise HTTPException(
-            status_code=400,detail="Invalid 'near' format. Use 'lat,lon' (e.g., '40.758,-73.9855').")
+    if cursor:
+        try:
+            last_name, last_id = decode_cursor(cursor, 2, (str, int))
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.filter(after(_keys(last_name, last_id)))
+        offset = 0
 
-    # only considers parks that have coordinates
-    q = q.filter(Park.lat.isnot(None), Park.lon.isnot(None))
+    q = q.order_by(Park.name, Park.id)
 
-    parks = q.all()
-    results: list[Park] = []
-    for p in parks:
-        d_km = haversine_km(lat_s, lon_s, float(p.lat), float(p.lon)) # run the haversine formula to find nearby
-        if d_km <= radius: # only give results within a certain radius
-            results.append(p)
+    if not near:
+        parks = q.offset(offset).limit(limit + 1).all()
+    else:
+        # Parse near="lat,lon"
+        try:
+            lat_s, lon_s = map(float, near.split(",")) # break up into the two different points of lat/lon
+        except Exception:
+            raise HTTPException(
+                status_code=400,detail="Invalid 'near' format. Use 'lat,lon' (e.g., '40.758,-73.9855').")
+
+        # only considers parks with coordinates inside the bounding box of the radius
+        q = q.filter(bbox_filter(Park.lat, Park.lon, lat_s, lon_s, radius))
+
+        def keep(rows: list[Park]) -> list[Park]:
+            kept = []
+            for p, d_km in within_radius(rows, lat_s, lon_s, radius): # exact distances, computed in one batch
+                p.distance_km = d_km
+                kept.append(p)
+            return kept
+
+        # walks the bbox rows in name order only until the page is full
+        parks = scan_page(q, lambda p: _keys(p.name, p.id), lambda rows: offload(keep, rows), offset + limit)[offset:]
+
+    if len(parks) > limit:
+        parks = parks[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([parks[-1].name, parks[-1].id])
+    return offload(json_response, response, List[schemas.ParkOut], parks)
+
+
+def _keys(name: str, park_id: int):
+    # keyset position for ORDER BY name, id
+    return [(Park.name, name, False), (Park.id, park_id, False)]
+
+
+@router.get("/search", response_model=List[schemas.ParkOut])
+async def search_parks(
+    response: Response,
+    q: str = Query(description="Search query for park name"),
+    fuzzy: bool = Query(default=False, description="Typo tolerant match, most similar first"),
+    limit: int = Query(default=50, ge=1, le=100),
+):
+    return await run_read(_search_parks, response, q, fuzzy, limit)
 
-    # sort by name
-    results_sorted = sorted(results, key=lambda p: p.name)
 
-    return results_sorted[offset : offset + limit] # chunks up the number of parks to be shown
+def _search_parks(db: Session, response: Response, q: str, fuzzy: bool, limit: int):
+    if not fuzzy:
+        # Case-insensitive partial match on park name
+        parks = db.query(Park).filter(Park.name.ilike(f"%{q}%")).order_by(Park.name).limit(limit).all()
+    else:
+        ids = [park_id for park_id, _ in offload(park_names.search, q, limit)]
+        by_id = {p.id: p for p in db.query(Park).filter(Park.id.in_(ids))} if ids else {}
+        parks = [by_id[i] for i in ids if i in by_id] # keep the similarity order
+    return offload(json_response, response, List[schemas.ParkOut], parks)
 
 
 @router.get("/{park_id}", response_model=schemas.ParkOut)
-def get_park(park_id: int, db: Session = Depends(get_db)):
+async def get_park(park_id: int, request: Request, response: Response):
+    return await run_read(_get_park, park_id, request, response)
+
+
+def _get_park(db: Session, park_id: int, request: Request, response: Response):
     park = db.get(Park, park_id) # gets a park by its id
     if not park:
         raise HTTPException(status_code=404, detail="Park not found")
-    return park
+    return cached_json(request, response, schemas.ParkOut, park, PARK_CACHE)
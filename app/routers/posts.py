@@ -3,38 +3,38 @@ Community Posts API router
 
 Endpoints:
 - POST/posts (create a post)
-- GET/posts (list posts, with optional filters)
+- GET/posts (list posts, with optional filters, newest first, cursor paginated via X-Next-Cursor)
 - GET/posts/{post_id} (get single post)
 - PATCH/posts/{post_id} (update own post)
 - DELETE/posts/{post_id} (delete own post)
 """
 
-from typing import Generator, List, Optional
+from datetime import datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.orm import Session, contains_eager, joinedload
 
-from app.db import SessionLocal
 from app.models import Post, Trail, User
+from app.services.feed import fan_out_post
 from app import schemas
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursor, after, decode_cursor, encode_cursor
 
 # adjust path if needed
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
+from app.db import offload, run_read
+from app.services.http_cache import json_response
 
 
 router = APIRouter(prefix="/posts", tags=["posts"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# the author columns a PostOut needs, loaded with the post instead of one query per post
+AUTHOR_COLUMNS = (User.id, User.display_name)
 
 
-def _to_post_out(post: Post) -> schemas.PostOut:
-    # assumes post.user is loaded; SQLAlchemy will lazy-load if needed
+def post_out(post: Post) -> schemas.PostOut:
+    # assumes post.user is loaded (see AUTHOR_COLUMNS); SQLAlchemy will lazy-load if needed
     return schemas.PostOut(
         id=post.id,
         user_id=post.user_id,
@@ -76,17 +76,20 @@ def create_post(
     )
 
     db.add(post)
+    db.flush()
+    fan_out_post(db, post, current_user) # into the followers' Friends feeds, same transaction
     db.commit()
     db.refresh(post)
 
-    return _to_post_out(post)
+    return post_out(post)
 
 
 @router.get(
     "/",
     response_model=List[schemas.PostOut],
 )
-def list_posts( # filters are optional
+async def list_posts( # filters are optional
+    response: Response,
     trail_id: Optional[int] = Query(
         default=None,
         description="Filter by trail_id",
@@ -104,14 +107,29 @@ def list_posts( # filters are optional
     offset: int = Query(
         default=0,
         ge=0,
-        description="Number of posts to skip",
+        deprecated=True,
+        description="Number of posts to skip. Use 'cursor' instead, it stays fast on deep pages.",
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="X-Next-Cursor header value from the previous page",
     ),
-    db: Session = Depends(get_db),
 ):
     """
     List community posts, can optionally filter by trail or user
+    Pages are keyset based on (created_at, id): pass the X-Next-Cursor header of a page
+    as 'cursor' to get the next one (no header = last page)
     """
-    q = db.query(Post).join(User)
+    return await run_read(_list_posts, response, trail_id, author_id, limit, offset, cursor)
+
+
+def _list_posts(db: Session, response: Response, trail_id: Optional[int], author_id: Optional[int],
+                limit: int, offset: int, cursor: Optional[str]):
+    q = (
+        db.query(Post)
+        .join(Post.user)
+        .options(contains_eager(Post.user).load_only(*AUTHOR_COLUMNS)) # fill post.user from the join
+    )
 
     if trail_id is not None:
         q = q.filter(Post.trail_id == trail_id)
@@ -119,32 +137,58 @@ def list_posts( # filters are optional
     if author_id is not None:
         q = q.filter(Post.user_id == author_id)
 
-    posts = (
-        q.order_by(Post.created_at.desc())
+    if cursor:
+        try:
+            last_created, last_id = decode_cursor(cursor, 2, (datetime, int))
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.filter(after([
+            (Post.created_at, last_created, True),
+            (Post.id, last_id, True),
+        ]))
+        offset = 0
+
+    rows = (
+        q.order_by(Post.created_at.desc(), Post.id.desc())
         .offset(offset)
-        .limit(limit)
+        .limit(limit + 1)
         .all()
     )
 
-    return [_to_post_out(p) for p in posts]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_post = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([last_post.created_at, last_post.id])
+
+    return offload(_page_json, response, rows)
+
+
+def _page_json(response: Response, rows: List[Post]) -> Response:
+    return json_response(response, List[schemas.PostOut], [post_out(p) for p in rows])
 
 
 @router.get(
     "/{post_id}",
     response_model=schemas.PostOut,
 )
-def get_post(
-    post_id: int,
-    db: Session = Depends(get_db),
-):
+async def get_post(post_id: int):
     """
     Get a single post by id
     """
-    post = db.query(Post).filter(Post.id == post_id).first()
+    return await run_read(_get_post, post_id)
+
+
+def _get_post(db: Session, post_id: int):
+    post = (
+        db.query(Post)
+        .options(joinedload(Post.user).load_only(*AUTHOR_COLUMNS))
+        .filter(Post.id == post_id)
+        .first()
+    )
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    return _to_post_out(post)
+    return post_out(post)
 
 
 @router.patch(
@@ -178,7 +222,7 @@ def update_post(
     db.commit()
     db.refresh(post)
 
-    return _to_post_out(post)
+    return post_out(post)
 
 
 @router.delete(
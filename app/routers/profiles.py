@@ -7,30 +7,20 @@ Endpoints:
 - GET /profiles/{user_id} (public view of another user's profile)
 """
 
-from typing import Generator
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
-from app.db import SessionLocal
 from app.models import Profile, User
 from app import schemas
 
 
-from app.callback import get_current_user
+from app.callback import get_current_user, get_db
 
 
 router = APIRouter(prefix="/profiles", tags=["profiles"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 def _get_or_create_profile(db: Session, user: User) -> Profile:
     profile = db.get(Profile, user.id)
     if profile:
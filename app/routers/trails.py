@@ -2,62 +2,187 @@
 Trails API router.
 
 Endpoints:
-- GET /trails/ = list trails filter by nearby lat/lon + radius
-- GET /trails/search = search trails by name
+- GET /trails/ = list trails filter by nearby lat/lon + radius (+ the filters below),
+  best rated first, cursor paginated (next cursor in the X-Next-Cursor header)
+- GET /trails/filter = trails matching difficulty/length/elevation/feature/rating filters, plus facet counts
+- GET /trails/search = full text search over trail name, park name and state
+- GET /trails/autocomplete = trail/park name suggestions for a typed prefix, served from memory
+- GET /trails/nearest = the k closest trails to a lat/lon, closest first
+- GET /trails/viewport = map markers inside a bbox, clustered at low zoom levels
 - GET /trails/{trail_id} = get one trail by id
-- POST /trails/{trail_id}/reviews = add a review to a trail then it recomputes avg and count
+- POST /trails/{trail_id}/reviews = add a review to a trail and update its avg and count
+- GET /trails/{trail_id}/reviews = reviews of a trail, Recent or Popular, cursor paginated
 
 GET is when the user retrieves data, and POST is when the user is uploading data.
 
 Notes:
-- Uses a Haversine distance function for nearby filtering.
+- Nearby filtering first narrows trails down in SQL to the grid cells and bounding box around
+  the point (services/geo.py), then computes distances for those candidates in one batch.
 - Uses a request  DB session dependency.
-- Recomputes ratings after inserting a review.
+- Updates the trail's rating sum/count/avg in the same transaction as the review insert.
 """
 
-from typing import Generator, List, Optional
-from math import radians, sin, cos, asin, sqrt
-
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
 from datetime import datetime
-import os
-import pathlib
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File, Form
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import case, func
 from sqlalchemy.exc import IntegrityError
 
-from app.db import SessionLocal
 from app import models, schemas
 
 from app.callback import get_current_user, get_db
+from app.db import offload, run_read
 from app.models import User, Trail, Review, Photos
+from app.services.geo import cell_filter, bbox_filter, distances_km, within_radius, nearest
+from app.services.clusters import trail_clusters, CLUSTER_MAX_ZOOM
+from app.services.search import search_trail_ids
+from app.services.trigram import trail_names
+from app.services.autocomplete import name_suggestions
+from app.services.pagination import NEXT_CURSOR_HEADER, InvalidCursor, after, decode_cursor, encode_cursor, scan_page
+from app.services.ratings import apply_new_rating
+from app.services.media import blob_lock, discard, image_extension, release_blob, stage_upload, store_blob, too_large_detail, UploadTooLarge
+from app.services.photo_variants import photo_out, schedule_variants
+from app.services.http_cache import PHOTO_LIST_CACHE, TRAIL_CACHE, TRAIL_LIST_CACHE, cached_json, json_response
+from app.config import settings
 
 router = APIRouter(prefix="/trails", tags=["trails"])
 
 
-def get_db() -> Generator[Session, None, None]:
-    # Create a new SQLAlchemy Session for this request and then close it after
-    db = SessionLocal()
+class TrailFilters:
+    """
+    The filter query params as SQL conditions. Difficulty is kept apart from the rest
+    so the facet counts can leave it out.
+    """
+
+    def __init__(self, difficulties: Optional[list[str]], conditions: list):
+        self.difficulties = difficulties
+        self.conditions = conditions
+
+    def all(self) -> list:
+        if self.difficulties is None:
+            return self.conditions
+        return self.conditions + [models.Trail.difficulty.in_(self.difficulties)]
+
+    def wants(self, difficulty: str) -> bool:
+        return self.difficulties is None or difficulty in self.difficulties
+
+
+def trail_filters(
+        difficulty: Optional[str] = Query(
+            default=None,
+            description="Comma-separated difficulties to keep, e.g. 'hard' or 'easy,moderate'.",
+        ),
+        min_length_km: Optional[float] = Query(default=None, ge=0),
+        max_length_km: Optional[float] = Query(default=None, ge=0),
+        min_elevation_m: Optional[float] = Query(default=None, ge=0),
+        max_elevation_m: Optional[float] = Query(default=None, ge=0),
+        accessible: Optional[bool] = Query(default=None),
+        has_waterfall: Optional[bool] = Query(default=None),
+        has_viewpoint: Optional[bool] = Query(default=None),
+        min_rating: Optional[float] = Query(default=None, ge=0, le=5),
+) -> TrailFilters:
+    T = models.Trail
+    conds = []
+    if min_length_km is not None:
+        conds.append(T.length_km >= min_length_km)
+    if max_length_km is not None:
+        conds.append(T.length_km <= max_length_km)
+    if min_elevation_m is not None:
+        conds.append(T.elevation_gain_m >= min_elevation_m)
+    if max_elevation_m is not None:
+        conds.append(T.elevation_gain_m <= max_elevation_m)
+    # "= 1" rather than "IS 1": only that form lets SQLite use the partial index of the flag
+    if accessible is not None:
+        conds.append(T.accessible == accessible)
+    if has_waterfall is not None:
+        conds.append(T.has_waterfall == has_waterfall)
+    if has_viewpoint is not None:
+        conds.append(T.has_viewpoint == has_viewpoint)
+    if min_rating is not None:
+        conds.append(T.avg_rating >= min_rating)
+
+    difficulties = None
+    if difficulty:
+        difficulties = [d.strip().lower() for d in difficulty.split(",") if d.strip()]
+    return TrailFilters(difficulties, conds)
+
+
+def _parse_coords(value: str, param: str, fmt: str) -> list[float]:
+    # "a,b,..." -> floats, as many as fmt has parts, e.g. near="lat,lon"
     try:
-        yield db
-    finally:
-        db.close()
+        numbers = [float(part) for part in value.split(",")]
+    except ValueError:
+        numbers = []
+    if len(numbers) != fmt.count(",") + 1:
+        raise HTTPException(status_code=400, detail=f"Invalid '{param}' format. Use '{fmt}'.")
+    return numbers
+
+
+def _check_lat_lon(lat: float, lon: float, param: str) -> None:
+    # written so NaN fails too
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(
+            status_code=400,
+            detail=f"'{param}' out of range: latitude must be within -90..90 and longitude within -180..180.",
+        )
+
+
+def _parse_near(near: str) -> tuple[float, float]:
+    # Parse near="lat,lon"
+    lat_s, lon_s = _parse_coords(near, "near", "lat,lon")
+    _check_lat_lon(lat_s, lon_s, "near")
+    return lat_s, lon_s
+
+
+def _parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    # Parse bbox="minLon,minLat,maxLon,maxLat", minLon > maxLon means it crosses the antimeridian
+    min_lon, min_lat, max_lon, max_lat = _parse_coords(bbox, "bbox", "minLon,minLat,maxLon,maxLat")
+    _check_lat_lon(min_lat, min_lon, "bbox")
+    _check_lat_lon(max_lat, max_lon, "bbox")
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox minLat must not be greater than maxLat.")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _near_filter(lat_s: float, lon_s: float, radius: float):
+    # only load trails whose grid cell overlaps the search circle (uses the geo_cell index),
+    # and drop the corners of those cells with the bounding box
+    return (
+        cell_filter(models.Trail.geo_cell, lat_s, lon_s, radius),
+        bbox_filter(models.Trail.lat, models.Trail.lon, lat_s, lon_s, radius),
+    )
+
+
+def _in_radius(trails: list[models.Trail], lat_s: float, lon_s: float, radius: float) -> list[models.Trail]:
+    results: list[models.Trail] = []
+    for t, d_km in within_radius(trails, lat_s, lon_s, radius):  # exact distances, computed in one batch
+        t.distance_km = d_km
+        results.append(t)
+    return results
+
 
+def _nearby(q, lat_s: float, lon_s: float, radius: float) -> list[models.Trail]:
+    return _in_radius(q.filter(*_near_filter(lat_s, lon_s, radius)).all(), lat_s, lon_s, radius)
 
-# Haversine formula in KM for nearby filtering -- gets nearby between TWO points
-def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    # Compute great circle distance between two (lat,lon) points in kilometers.
-    R = 6371.0  # this is earths radius
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    return 2 * R * asin(sqrt(a))
+
+def _score_keys(avg_rating: float, trail_id: int):
+    # keyset position for ORDER BY avg_rating DESC, id
+    return [(models.Trail.avg_rating, avg_rating, True), (models.Trail.id, trail_id, False)]
+
+
+def _by_rating(trails: list[models.Trail]) -> list[models.Trail]:
+    # Sort by rating decreasing, then length increasing
+    return sorted(trails, key=lambda t: (-t.avg_rating, t.length_km or 1e9))
 
 
 # GET /trails/  (list + optional nearby filter)
 @router.get("/", response_model=List[schemas.TrailOut])
 # response model is how our output is given from the schemas, i.e. after a link that is / -- the information of trails is outputted with the data we defined in schema for Trail Out
-def list_trails(
+async def list_trails(
+        request: Request,
+        response: Response,
         near: Optional[str] = Query(
             default=None,
             description="Comma-separated 'lat,lon' to filter by nearby (e.g., '40.758,-73.9855').",
@@ -69,80 +194,271 @@ def list_trails(
             le=200,
             description="Search radius in kilometers when 'near' is provided (0.1–200).",
         ),
-        db: Session = Depends(get_db),
+        cursor: Optional[str] = Query(
+            default=None,
+            description="X-Next-Cursor header value from the previous page.",
+        ),
+        filters: TrailFilters = Depends(trail_filters),
 ):
     """
-    Return up to 100 trails, or up to 50 nearby trails if we have near values.
-    Sort nearby by avg_rating, then length_km. Good trails will have priority.
+    Return pages of up to 100 trails, or up to 50 nearby trails if we have near values.
+    Sorted by avg_rating, best first (then id). Good trails will have priority.
+    Pages are keyset based on (avg_rating, id): pass the X-Next-Cursor header as 'cursor' for the next page.
     """
-    q = db.query(models.Trail)
+    return await run_read(_list_trails, request, response, near, radius, cursor, filters)
+
+
+def _list_trails(
+        db: Session,
+        request: Request,
+        response: Response,
+        near: Optional[str],
+        radius: float,
+        cursor: Optional[str],
+        filters: TrailFilters,
+):
+    q = db.query(models.Trail).filter(*filters.all())
+
+    if cursor:
+        try:
+            last_rating, last_id = decode_cursor(cursor, 2, (float, int))
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.filter(after(_score_keys(last_rating, last_id)))
+
+    q = q.order_by(models.Trail.avg_rating.desc(), models.Trail.id)
 
     if not near:  # this means that if the query string provided has no lat/lon to look through
-        return q.limit(100).all()
+        limit = 100
+        trails = q.limit(limit + 1).all()
+    else:
+        limit = 50
+        lat_s, lon_s = _parse_near(near)
+        trails = scan_page(
+            q.filter(*_near_filter(lat_s, lon_s, radius)),
+            lambda t: _score_keys(t.avg_rating, t.id),
+            lambda rows: offload(_in_radius, rows, lat_s, lon_s, radius),
+            limit,
+        )
 
-    # Parse near="lat,lon"
-    try:
-        lat_s, lon_s = map(float, near.split(","))  # break up into the two different points of lat/lon
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid 'near' format. Use 'lat,lon'.")
+    if len(trails) > limit:
+        trails = trails[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([trails[-1].avg_rating, trails[-1].id])
+    return offload(cached_json, request, response, List[schemas.TrailOut], trails, TRAIL_LIST_CACHE)
 
-    q = q.filter(models.Trail.lat.isnot(None), models.Trail.lon.isnot(None))
 
-    results: list[models.Trail] = []
-    for t in q.all():
-        d_km = haversine_km(lat_s, lon_s, float(t.lat), float(t.lon))  # run the haversine formula to find nearby
-        if d_km <= radius:  # only give results within a certain radius
-            results.append(t)
+# GET /trails/filter (filtered trails + facet counts for the filter chips)
+@router.get("/filter", response_model=schemas.TrailFilterOut)
+def filter_trails(
+        near: Optional[str] = Query(
+            default=None,
+            description="Optional comma-separated 'lat,lon' to only keep trails within 'radius'.",
+            examples=["40.758,-73.9855"],
+        ),
+        radius: float = Query(default=50, ge=0.1, le=200, description="Radius in kilometers when 'near' is provided."),
+        limit: int = Query(default=50, ge=1, le=100),
+        filters: TrailFilters = Depends(trail_filters),
+        db: Session = Depends(get_db),
+):
+    """
+    Trails matching every filter, best rated first, plus facet counts:
+    - difficulty counts ignore the difficulty filter itself, so every chip shows what picking it would give
+    - feature counts (accessible, waterfall, viewpoint) are within the current results
+    """
+    T = models.Trail
+    difficulty_counts: dict[str, int] = {}
+    facets = schemas.TrailFacetsOut()
 
-    # Sort by rating decreasing, then length increasing
-    return sorted(results, key=lambda t: (-t.avg_rating, t.length_km or 1e9))[:50]
+    if near:
+        # the radius is only exact after the distance check, so count the facets in Python
+        lat_s, lon_s = _parse_near(near)
+        matches = []
+        for t in _nearby(db.query(T).filter(*filters.conditions), lat_s, lon_s, radius):
+            difficulty_counts[t.difficulty] = difficulty_counts.get(t.difficulty, 0) + 1
+            if filters.wants(t.difficulty):
+                matches.append(t)
+                facets.total += 1
+                facets.accessible += int(bool(t.accessible))
+                facets.has_waterfall += int(bool(t.has_waterfall))
+                facets.has_viewpoint += int(bool(t.has_viewpoint))
+        facets.difficulty = difficulty_counts
+        return schemas.TrailFilterOut(trails=_by_rating(matches)[:limit], facets=facets)
+
+    # one GROUP BY gives the difficulty counts and the feature counts per difficulty
+    rows = (
+        db.query(
+            T.difficulty,
+            func.count(T.id),
+            func.sum(case((T.accessible.is_(True), 1), else_=0)),
+            func.sum(case((T.has_waterfall.is_(True), 1), else_=0)),
+            func.sum(case((T.has_viewpoint.is_(True), 1), else_=0)),
+        )
+        .filter(*filters.conditions)
+        .group_by(T.difficulty)
+        .all()
+    )
+    for difficulty, count, accessible, waterfall, viewpoint in rows:
+        difficulty_counts[difficulty] = count
+        if filters.wants(difficulty):
+            facets.total += count
+            facets.accessible += accessible or 0
+            facets.has_waterfall += waterfall or 0
+            facets.has_viewpoint += viewpoint or 0
+    facets.difficulty = difficulty_counts
+
+    trails = (
+        db.query(T)
+        .filter(*filters.all())
+        .order_by(T.avg_rating.desc(), T.length_km.is_(None), T.length_km, T.id)
+        .limit(limit)
+        .all()
+    )
+    return schemas.TrailFilterOut(trails=trails, facets=facets)
 
 
 # ADD THIS NEW ENDPOINT
 @router.get("/search", response_model=List[schemas.TrailOut])
-def search_trails(
-        q: str = Query(description="Search query for trail name"),
+async def search_trails(
+        response: Response,
+        q: str = Query(description="Search query for trail name, park name or state"),
         near: Optional[str] = Query(default=None, description="Optional 'lat,lon' for distance sorting"),
         limit: int = Query(default=50, ge=1, le=100),
-        db: Session = Depends(get_db),
+        fuzzy: bool = Query(default=False, description="Typo tolerant match on trail names, most similar first"),
 ):
     """
-    Search trails by name (case-insensitive partial match)
+    Search trails by trail name, park name or state.
+    Uses the FTS5 index (prefix matching, BM25 ranked) and falls back to a LIKE scan without it.
+    With fuzzy=true the in-memory trigram index is used instead, so misspelled names still match.
     Optionally sort by distance if 'near' lat,lon is provided
     """
-    # Case-insensitive search on trail name
-    query = db.query(models.Trail).filter(
-        models.Trail.name.ilike(f"%{q}%")
-    )
+    return await run_read(_search_trails, response, q, near, limit, fuzzy)
 
-    trails = query.limit(limit).all()
 
+def _search_trails(db: Session, response: Response, q: str, near: Optional[str], limit: int, fuzzy: bool):
+    if fuzzy:
+        ids = [trail_id for trail_id, _ in offload(trail_names.search, q, limit)]
+    else:
+        ids = search_trail_ids(db, q, limit)
+    if ids is None:
+        # Case-insensitive search on trail name
+        trails = db.query(models.Trail).filter(models.Trail.name.ilike(f"%{q}%")).limit(limit).all()
+    else:
+        by_id = {t.id: t for t in db.query(models.Trail).filter(models.Trail.id.in_(ids))} if ids else {}
+        trails = [by_id[i] for i in ids if i in by_id]  # keep the ranking order
+    return offload(_search_results, response, trails, near)
+
+
+def _search_results(response: Response, trails: list[models.Trail], near: Optional[str]) -> Response:
     # If near is provided, sort by distance
     if near:
         try:
             lat_s, lon_s = map(float, near.split(","))
-            results_with_dist = []
-            for trail in trails:
-                if trail.lat and trail.lon:
-                    dist = haversine_km(lat_s, lon_s, float(trail.lat), float(trail.lon))
-                    results_with_dist.append((dist, trail))
+            located = [t for t in trails if t.lat is not None and t.lon is not None]
+            dists = distances_km(lat_s, lon_s, [t.lat for t in located], [t.lon for t in located])
+            for trail, dist in zip(located, dists):
+                trail.distance_km = float(dist)
 
             # Sort by distance and return trails
-            results_with_dist.sort(key=lambda x: x[0])
-            return [trail for _, trail in results_with_dist]
-        except Exception:
+            trails = sorted(located, key=lambda t: t.distance_km)
+        except ValueError:
             pass  # If parsing fails, just return unsorted results
 
-    return trails
+    return json_response(response, List[schemas.TrailOut], trails)
+
+
+# GET /trails/autocomplete (search box suggestions as the user types)
+@router.get("/autocomplete", response_model=List[schemas.SuggestionOut])
+def autocomplete(
+        prefix: str = Query(min_length=1, description="What the user has typed so far"),
+        limit: int = Query(default=10, ge=1, le=20),
+        db: Session = Depends(get_db),
+):
+    """
+    Trail and park names where any word starts with 'prefix', most rated first.
+    Answered from the in-memory list in services/autocomplete.py, the DB is only read to rebuild it.
+    """
+    return [
+        schemas.SuggestionOut(kind=kind, id=item_id, name=name)
+        for kind, item_id, name, _ in name_suggestions.suggest(db, prefix, limit)
+    ]
+
+
+# GET /trails/nearest (closest trails first, walks the spatial grid outwards)
+@router.get("/nearest", response_model=List[schemas.TrailOut])
+def nearest_trails(
+        near: str = Query(
+            description="Comma-separated 'lat,lon' to search around.",
+            examples=["40.758,-73.9855"],
+        ),
+        k: int = Query(default=10, ge=1, le=100, description="How many trails to return."),
+        max_km: float = Query(
+            default=200,
+            ge=0.1,
+            le=1000,
+            description="Ignore trails farther away than this many kilometers.",
+        ),
+        db: Session = Depends(get_db),
+):
+    """
+    Return the k trails closest to 'near', sorted by distance with distance_km filled in.
+    Only the grid cells around the point are loaded, ring by ring, until the k closest are certain.
+    """
+    lat_s, lon_s = _parse_near(near)
+
+    results: list[models.Trail] = []
+    for t, d_km in nearest(db.query(models.Trail), models.Trail.geo_cell, lat_s, lon_s, k, max_km):
+        t.distance_km = d_km
+        results.append(t)
+    return results
+
+
+# GET /trails/viewport (what the map screen needs for the visible area)
+@router.get("/viewport", response_model=schemas.ViewportOut)
+def viewport_trails(
+        bbox: str = Query(
+            description="Comma-separated 'minLon,minLat,maxLon,maxLat' of the visible map area.",
+            examples=["-74.3,40.5,-73.7,41.0"],
+        ),
+        zoom: int = Query(ge=0, le=22, description="Map zoom level (Google Maps style, 0-22)."),
+        limit: int = Query(default=500, ge=1, le=2000, description="Max trails returned at high zoom."),
+        db: Session = Depends(get_db),
+):
+    """
+    Below CLUSTER_MAX_ZOOM return clustered markers (count + centroid) from the precomputed grids,
+    at or above it return the individual trails inside the bbox.
+    """
+    min_lon, min_lat, max_lon, max_lat = _parse_bbox(bbox)
+
+    if zoom < CLUSTER_MAX_ZOOM:
+        markers = trail_clusters.clusters(db, zoom, min_lon, min_lat, max_lon, max_lat)
+        return schemas.ViewportOut(
+            zoom=zoom,
+            clusters=[
+                schemas.ClusterOut(lat=lat, lon=lon, count=count, trail_id=trail_id)
+                for lat, lon, count, trail_id in markers
+            ],
+        )
+
+    q = db.query(models.Trail).filter(models.Trail.lat.between(min_lat, max_lat))
+    if min_lon <= max_lon:
+        q = q.filter(models.Trail.lon.between(min_lon, max_lon))
+    else:  # viewport crosses the antimeridian
+        q = q.filter((models.Trail.lon >= min_lon) | (models.Trail.lon <= max_lon))
+    trails = q.order_by(models.Trail.avg_rating.desc(), models.Trail.id).limit(limit).all()
+    return schemas.ViewportOut(zoom=zoom, trails=trails)
 
 
 # GET /trails/{trail_id}
 @router.get("/{trail_id}", response_model=schemas.TrailOut)
-def get_trail(trail_id: int, db: Session = Depends(get_db)):
+async def get_trail(trail_id: int, request: Request, response: Response):
+    return await run_read(_get_trail, trail_id, request, response)
+
+
+def _get_trail(db: Session, trail_id: int, request: Request, response: Response):
     trail = db.get(models.Trail, trail_id)
     if not trail:
         raise HTTPException(status_code=404, detail="Trail not found")
-    return trail
+    return cached_json(request, response, schemas.TrailOut, trail, TRAIL_CACHE)
 
 
 # POST /trails/{trail_id}/reviews  (add a review)
@@ -166,25 +482,15 @@ def add_review(
         body=payload.body,
     )
     db.add(review)
+
+    # 3) Update stats from the running sum (computed by the DB in the UPDATE), same transaction as the insert
+    apply_new_rating(trail, payload.rating)
     try:
         db.commit()
     except IntegrityError as e:
         db.rollback()
         raise HTTPException(status_code=400, detail="Review could not be saved.") from e
 
-    # 3) Recompute stats
-    avg = db.execute(
-        text("SELECT ROUND(AVG(rating), 2) FROM reviews WHERE trail_id = :tid"),
-        # we look at the trail, then the reviews of the trail, and then take the avg of the ratings and round it
-        {"tid": trail_id},  # define the trail id as tid
-    ).scalar() or 0.0
-    count = db.execute(
-        text("SELECT COUNT(*) FROM reviews WHERE trail_id = :tid"),  # count how many reviews a trail has
-        {"tid": trail_id},
-    ).scalar() or 0
-    trail.avg_rating, trail.ratings_count = float(avg), int(count)
-    db.commit()
-
     return schemas.MsgOut(ok=True, message="Review added")
 
 
@@ -192,6 +498,13 @@ def add_review(
 @router.get("/{trail_id}/reviews", response_model=List[schemas.ReviewOut])
 def list_reviews_for_trail(
         trail_id: int,
+        response: Response,
+        sort: Literal["recent", "popular"] = Query(
+            default="recent",
+            description="'recent' = newest first, 'popular' = best rated first (newest first within a rating)",
+        ),
+        limit: int = Query(default=20, ge=1, le=100),
+        cursor: Optional[str] = Query(default=None, description="X-Next-Cursor header value from the previous page."),
         db: Session = Depends(get_db),
 ):
     # make sure the trail actually exists
@@ -199,19 +512,34 @@ def list_reviews_for_trail(
     if not trail:
         raise HTTPException(status_code=404, detail="Trail not found")
 
-    # sort by newest trails first
-    reviews = (
-        db.query(Review)
-        .filter(Review.trail_id == trail_id)
-        .all()
-    )
-    return reviews
+    # one page at a time, walking the (trail_id, [rating,] created_at) index
+    q = db.query(Review).filter(Review.trail_id == trail_id)
+
+    if sort == "popular":
+        order = [Review.rating.desc(), Review.created_at.desc(), Review.id.desc()]
+        key_columns = [Review.rating, Review.created_at, Review.id]
+        key_types = (int, datetime, int)
+    else:
+        order = [Review.created_at.desc(), Review.id.desc()]
+        key_columns = [Review.created_at, Review.id]
+        key_types = (datetime, int)
+
+    if cursor:
+        try:
+            values = decode_cursor(cursor, len(key_columns), key_types)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.filter(after([(column, value, True) for column, value in zip(key_columns, values)]))
+
+    rows = q.order_by(*order).limit(limit + 1).all()
 
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = [last.created_at, last.id] if sort == "recent" else [last.rating, last.created_at, last.id]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(values)
 
-def safe_file(
-        original: str) -> str:  # this just cleans the filename so there shouldnt be any path components in the name.
-    name = os.path.basename(original)
-    return name
+    return rows
 
 
 @router.post("/{trail_id}/photos", response_model=schemas.PhotosOut)
@@ -231,44 +559,48 @@ def upload_photo(
     if not (file.content_type or "").startswith("image/"):
         raise HTTPException(status_code=400, detail="Only images allowed")
 
-    folder = pathlib.Path("media") / "trails" / str(trail_id)
-    folder.mkdir(parents=True, exist_ok=True)
-
-    ts = int(datetime.utcnow().timestamp())
-    safe_name = safe_file(file.filename or "upload.bin")
-    dest_rel = pathlib.Path("trails") / str(trail_id) / f"{ts}_{safe_name}"
-    dest_abs = pathlib.Path("media") / dest_rel
-
-    # Save file
-    with dest_abs.open("wb") as out:
-        out.write(file.file.read())
+    # Save file (streamed in chunks with a size cap, stored once per content hash)
+    try:
+        tmp_path, content_hash, size = stage_upload(file.file, settings.UPLOAD_MAX_BYTES, settings.UPLOAD_CHUNK_BYTES)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=too_large_detail(settings.UPLOAD_MAX_BYTES))
 
-    # Save DB row
-    photo = Photos(
-        trail_id=trail_id,
-        user_id=current_user.id,
-        file_path=str(dest_rel).replace("\\", "/"),
-        caption=caption,
-    )
-    db.add(photo)
-    db.commit()
+    try:
+        # a photo delete can't remove the blob between storing it and committing our row
+        with blob_lock:
+            file_path = store_blob(tmp_path, content_hash, image_extension(file.content_type, file.filename))
+
+            # same image uploaded before: share its resized copies instead of making them again
+            existing = db.query(Photos).filter(Photos.file_path == file_path).first()
+
+            # Save DB row
+            photo = Photos(
+                trail_id=trail_id,
+                user_id=current_user.id,
+                file_path=file_path,
+                content_hash=content_hash,
+                size_bytes=size,
+                caption=caption,
+                variants=existing.variants if existing else None,
+            )
+            db.add(photo)
+            db.commit()
+    finally:
+        discard(tmp_path)  # no-op once stored
     db.refresh(photo)
 
-    # url that gets pushed out for users
-    url = f"/media/{photo.file_path}"
-    return schemas.PhotosOut(
-        id=photo.id,
-        trail_id=photo.trail_id,
-        user_id=photo.user_id,
-        caption=photo.caption,
-        created_at=photo.created_at,
-        url=url,
-    )
+    # thumb/card/full copies are made in a worker process and show up on the row when done
+    if not photo.variants:
+        schedule_variants(photo.id, photo.file_path)
+
+    return photo_out(photo)
 
 
 @router.get("/{trail_id}/photos", response_model=list[schemas.PhotosOut])
 def list_trail_photos(
         trail_id: int,
+        request: Request,
+        response: Response,
         db: Session = Depends(get_db),
 ):
     """
@@ -285,16 +617,28 @@ def list_trail_photos(
         .all()
     )
 
-    out: list[schemas.PhotosOut] = []
-    for p in photos:
-        out.append(
-            schemas.PhotosOut(
-                id=p.id,
-                trail_id=p.trail_id,
-                user_id=p.user_id,
-                caption=p.caption,
-                created_at=p.created_at,
-                url=f"/media/{p.file_path}",
-            )
-        )
-    return out
+    return cached_json(
+        request, response, list[schemas.PhotosOut], [photo_out(p) for p in photos], PHOTO_LIST_CACHE
+    )
+
+
+@router.delete("/{trail_id}/photos/{photo_id}", status_code=204)
+def delete_trail_photo(
+        trail_id: int,
+        photo_id: int,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user),
+):
+    """
+    Delete one of your photos. The file goes away once no other photo uses the same image.
+    """
+    photo = db.get(Photos, photo_id)
+    if not photo or photo.trail_id != trail_id:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    if photo.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not your photo")
+
+    release_blob(db, photo)  # files go once the delete is committed
+    db.delete(photo)
+    db.commit()
+    return Response(status_code=204)
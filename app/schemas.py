@@ -27,12 +27,49 @@ class TrailOut(BaseModel):
     has_viewpoint: bool = False
     avg_rating: float = 0.0
     ratings_count: int = 0
+    distance_km: Optional[float] = None # only filled in for nearby/distance sorted results
 
     # Tells Pydantic to read data directly from SQLAlchemy models
     class Config:
         from_attributes = True
 
 
+class TrailFacetsOut(BaseModel):
+    # counts behind the filter chips
+    total: int = 0
+    difficulty: dict[str, int] = {} # ignores the difficulty filter, so each chip shows what picking it gives
+    accessible: int = 0
+    has_waterfall: int = 0
+    has_viewpoint: int = 0
+
+
+class TrailFilterOut(BaseModel):
+    trails: list[TrailOut] = []
+    facets: TrailFacetsOut
+
+
+class ClusterOut(BaseModel):
+    # one map marker standing in for `count` trails, placed at their centroid
+    lat: float
+    lon: float
+    count: int
+    trail_id: Optional[int] = None # set when the marker is a single trail
+
+
+class ViewportOut(BaseModel):
+    # low zoom levels get clusters, high zoom levels get the trails themselves
+    zoom: int
+    clusters: list[ClusterOut] = []
+    trails: list[TrailOut] = []
+
+
+class SuggestionOut(BaseModel):
+    # one autocomplete hit, either a trail or a park
+    kind: str # "trail" or "park"
+    id: int
+    name: str
+
+
 class TrailCreate(BaseModel):
   # users can create their trail
     name: str = Field(min_length=1, max_length=200)
@@ -59,6 +96,7 @@ class ReviewOut(BaseModel):
     user_id: int
     rating: int
     body: Optional[str] = None
+    created_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -70,6 +108,7 @@ class ParkOut(BaseModel):
     state: Optional[str] = None
     lat: Optional[float] = None
     lon: Optional[float] = None
+    distance_km: Optional[float] = None # only filled in for nearby results
 
     class Config:
         from_attributes = True
@@ -80,7 +119,11 @@ class PhotosOut(BaseModel):
     trail_id: int
     user_id: int
     caption: Optional[str] = None
-    url: str
+    url: str # the original upload
+    # resized copies, these point at the original until the copies are ready
+    thumb_url: Optional[str] = None
+    card_url: Optional[str] = None
+    full_url: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -210,7 +253,39 @@ class PostOut(PostBase):
         from_attributes = True
 
 
+class FollowStatusOut(BaseModel):
+    ok: bool = True
+    is_following: bool
+    message: str = "success"
+
+
 class OfflineStatusOut(BaseModel):
     ok: bool = True
     is_offline: bool
     message: str = "success"
+
+
+class OfflineNoteOut(NoteOut): # offline copies need the note itself too
+    text: str
+    is_pinned: bool = False
+
+    class Config:
+        from_attributes = True
+
+
+class OfflineRemovedOut(BaseModel): # ids the client should drop from its offline copy
+    trails: list[int] = []
+    reviews: list[int] = []
+    notes: list[int] = []
+    photos: list[int] = []
+
+
+class OfflineSyncOut(BaseModel):
+    token: str # pass back as 'since' next time
+    reset: bool = False # true = this is everything, replace the offline copy instead of merging
+    trails: list[TrailOut] = []
+    parks: list[ParkOut] = []
+    reviews: list[ReviewOut] = []
+    notes: list[OfflineNoteOut] = []
+    photos: list[PhotosOut] = []
+    removed: OfflineRemovedOut = OfflineRemovedOut()
@@ -0,0 +1,40 @@
+"""
+Run work once a session's transaction has committed.
+
+ORM hooks (after_insert / after_update / after_delete) run when the session flushes, which is
+before the commit. In-memory caches that drop or rebuild themselves from those hooks could be
+rebuilt by another request in between, from data that doesn't have the change yet, and then
+look fresh. Hooks call on_commit() instead and the work runs after the commit (or never, on
+rollback).
+"""
+
+from typing import Callable, Hashable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+_PENDING = "after_commit.pending"
+
+
+def on_commit(target, key: Hashable, fn: Callable[[], None]) -> None:
+    """
+    Run fn after the transaction of target's session commits. Calls with the same key in one
+    transaction run fn once. target is an ORM object (as passed to mapper hooks) or a Session.
+    """
+    session = target if isinstance(target, Session) else object_session(target)
+    if session is None:  # not in a session, nothing to wait for
+        fn()
+        return
+    session.info.setdefault(_PENDING, {})[key] = fn
+
+
+@event.listens_for(Session, "after_commit")
+def _run_pending(session: Session) -> None:
+    for fn in session.info.pop(_PENDING, {}).values():
+        fn()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session: Session, previous_transaction) -> None:
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING, None)
@@ -0,0 +1,90 @@
+"""
+Cache of verified access tokens.
+
+get_current_user used to check the JWT signature and load the user row on every request. Now a
+token that was verified once maps to a snapshot of its user's columns for a short while
+(AUTH_CACHE_TTL_SECONDS, never past the token's own expiry), so a repeat request skips both.
+The cache is an LRU bounded to AUTH_CACHE_SIZE tokens.
+
+A user's entries are dropped whenever the user row is updated (password change, profile edits)
+or deleted through the ORM, see the hooks at the bottom. The cache is per process: with several
+workers another worker's copy goes stale for at most the TTL.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+
+from app.config import settings
+from app.models import User
+
+Snapshot = Dict[str, Any]
+
+# changed by bulk UPDATEs that skip the hooks below, so left out and loaded when used
+NOT_CACHED = {"followers_count"}
+
+
+class TokenCache:
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Snapshot]]" = OrderedDict()  # token -> (expires at, snapshot)
+        self._by_user: Dict[int, Set[str]] = {}
+        self._lock = Lock()
+
+    def get(self, token: str) -> Optional[Snapshot]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if time.time() >= expires_at:
+                self._drop(token)
+                return None
+            self._entries.move_to_end(token)
+            return snapshot
+
+    def put(self, token: str, user: User, token_exp: float) -> None:
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        snapshot = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs if attr.key not in NOT_CACHED}
+        expires_at = min(time.time() + self.ttl_seconds, token_exp)
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (expires_at, snapshot)
+            self._by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))  # least recently used
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._drop(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _drop(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[1]["id"]
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user_id]
+
+
+verified_tokens = TokenCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target: User) -> None:
+    verified_tokens.invalidate_user(target.id)
@@ -0,0 +1,168 @@
+"""
+Prefix autocomplete for the search box.
+
+Trail and park names are kept in memory as one sorted list of lowercase keys. Every word of
+a name gets its own key ("central park loop", "park loop", "loop"), so typing any word of a
+name finds it. A prefix is answered with two bisects over that list plus a pick of the
+highest weighted entries in between; the weight is ratings_count for trails and the sum of
+its trails' ratings_count for parks. Prefixes of up to three letters match huge ranges, so
+their answers are precomputed when the list is built.
+
+Nothing here touches the DB except a rebuild. The list is built at startup; after that,
+adding, renaming or deleting a trail/park (once committed) makes the next call start a rebuild
+in a background thread, and calls keep getting the current list until the new one is swapped
+in. Rating count changes are picked up at most WEIGHT_REFRESH_SECONDS later so busy review
+traffic doesn't cause constant rebuilds.
+"""
+
+import heapq
+import logging
+import re
+import time
+from bisect import bisect_left
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Park, Trail
+from app.services.after_commit import on_commit
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 20
+PRECOMPUTED_PREFIX_LEN = 3
+WEIGHT_REFRESH_SECONDS = 60.0
+
+# (kind, id, name, weight)
+Entry = Tuple[str, int, str, int]
+
+
+class Autocomplete:
+    def __init__(self) -> None:
+        self._keys: List[str] = []
+        self._entries: List[Entry] = []  # parallel to _keys
+        self._short: Dict[str, List[Entry]] = {}  # precomputed answers for short prefixes
+        self._built_at: Optional[float] = None
+        self._names_stale = True
+        self._weights_stale = False
+        self._rebuilding = False
+        self._lock = Lock()
+        self._build_lock = Lock()  # one build at a time
+
+    def mark_names_stale(self) -> None:
+        self._names_stale = True
+
+    def mark_weights_stale(self) -> None:
+        self._weights_stale = True
+
+    def _needs_rebuild(self) -> bool:
+        if self._names_stale or self._built_at is None:
+            return True
+        return self._weights_stale and time.monotonic() - self._built_at >= WEIGHT_REFRESH_SECONDS
+
+    def build(self, db: Session) -> None:
+        with self._build_lock:
+            self._build(db)
+
+    def _build(self, db: Session) -> None:
+        # cleared before reading, so a change committed while this reads marks it stale again
+        self._names_stale = self._weights_stale = False
+
+        park_weights = dict(
+            db.query(Trail.park_id, func.coalesce(func.sum(Trail.ratings_count), 0))
+            .filter(Trail.park_id.isnot(None))
+            .group_by(Trail.park_id)
+            .all()
+        )
+        entries: List[Entry] = [
+            ("trail", trail_id, name, count or 0)
+            for trail_id, name, count in db.query(Trail.id, Trail.name, Trail.ratings_count)
+        ]
+        entries += [
+            ("park", park_id, name, int(park_weights.get(park_id, 0)))
+            for park_id, name in db.query(Park.id, Park.name)
+        ]
+
+        keyed: List[Tuple[str, Entry]] = []
+        for entry in entries:
+            words = re.findall(r"\w+", entry[2].lower())
+            for i in range(len(words)):
+                keyed.append((" ".join(words[i:]), entry))
+        keyed.sort(key=lambda pair: pair[0])
+
+        short: Dict[str, List[Entry]] = {}
+        for key, entry in keyed:
+            for n in range(1, min(PRECOMPUTED_PREFIX_LEN, len(key)) + 1):
+                short.setdefault(key[:n], []).append(entry)
+        short = {prefix: _top(found, MAX_RESULTS) for prefix, found in short.items()}
+
+        with self._lock:
+            self._keys = [key for key, _ in keyed]
+            self._entries = [entry for _, entry in keyed]
+            self._short = short
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self, db: Session) -> None:
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        bind = db.get_bind()
+
+        def run() -> None:
+            try:
+                with Session(bind=bind) as own_db:
+                    self.build(own_db)
+            except Exception:
+                logger.exception("Autocomplete rebuild failed")
+                self.mark_names_stale()  # try again on a later call
+            finally:
+                self._rebuilding = False
+
+        Thread(target=run, name="autocomplete-rebuild", daemon=True).start()
+
+    def suggest(self, db: Session, prefix: str, limit: int) -> List[Entry]:
+        if self._built_at is None:
+            self.build(db)  # only if nothing built it at startup
+        elif self._needs_rebuild():
+            self._rebuild_in_background(db)
+
+        prefix = " ".join(re.findall(r"\w+", prefix.lower()))
+        if not prefix:
+            return []
+
+        with self._lock:
+            if len(prefix) <= PRECOMPUTED_PREFIX_LEN:
+                return self._short.get(prefix, [])[:limit]
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + "\uffff")
+            return _top(self._entries[lo:hi], limit)
+
+
+def _top(entries: List[Entry], limit: int) -> List[Entry]:
+    # highest weight first, each trail/park once even if several of its words matched
+    unique = {(e[0], e[1]): e for e in entries}
+    return heapq.nlargest(limit, unique.values(), key=lambda e: (e[3], -e[1]))
+
+
+name_suggestions = Autocomplete()
+
+
+@event.listens_for(Trail, "after_insert")
+@event.listens_for(Trail, "after_delete")
+@event.listens_for(Park, "after_insert")
+@event.listens_for(Park, "after_delete")
+def _names_changed(mapper, connection, target) -> None:
+    on_commit(target, "autocomplete.names", name_suggestions.mark_names_stale)
+
+
+@event.listens_for(Trail, "after_update")
+@event.listens_for(Park, "after_update")
+def _maybe_changed(mapper, connection, target) -> None:
+    state = inspect(target)
+    if state.attrs.name.history.has_changes():
+        on_commit(target, "autocomplete.names", name_suggestions.mark_names_stale)
+    elif isinstance(target, Trail) and state.attrs.ratings_count.history.has_changes():
+        on_commit(target, "autocomplete.weights", name_suggestions.mark_weights_stale)
@@ -0,0 +1,91 @@
+"""
+Change tracking for offline sync.
+
+Every insert, update and delete of a Trail, Review, Note, Photos or OfflineDownload row done
+through the ORM appends a ChangeLog row in the same transaction (see the hooks at the bottom),
+so a change is logged exactly when it commits. ChangeLog.seq only goes up; /offline/sync
+hands the last seq out as the client's sync token and later returns what was logged after it.
+
+Bulk UPDATEs skip the ORM hooks, so code doing those logs its rows with log_changes().
+Old entries are pruned after CHANGE_LOG_RETENTION_DAYS; a client whose token is older than
+that gets a full resync.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import delete, event, insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models import ChangeLog, Note, OfflineDownload, Photos, Review, Trail
+
+logger = logging.getLogger(__name__)
+
+TRACKED = (Trail, Review, Note, Photos, OfflineDownload)
+PRIVATE = {Note.__tablename__, OfflineDownload.__tablename__}  # only synced to their owner
+
+
+def _entry(target, deleted: bool) -> dict:
+    table = target.__tablename__
+    return {
+        "entity": table,
+        "row_id": target.id,
+        "trail_id": target.id if isinstance(target, Trail) else target.trail_id,
+        "user_id": target.user_id if table in PRIVATE else None,
+        "deleted": deleted,
+    }
+
+
+def log_changes(connection: Connection, entries: Iterable[dict]) -> None:
+    """Append ChangeLog rows (dicts with entity, row_id, trail_id, user_id, deleted)."""
+    entries = list(entries)
+    if entries:
+        connection.execute(insert(ChangeLog), entries)
+
+
+def trail_updates(trail_ids: Iterable[int]) -> list[dict]:
+    # log_changes() entries for trails updated in bulk
+    return [
+        {"entity": Trail.__tablename__, "row_id": i, "trail_id": i, "user_id": None, "deleted": False}
+        for i in trail_ids
+    ]
+
+
+def prune_changes(db: Session, retention_days: float) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)  # changed_at is stored as UTC
+    removed = db.execute(delete(ChangeLog).where(ChangeLog.changed_at < cutoff)).rowcount
+    db.commit()
+    return removed
+
+
+def start_pruner(session_factory, retention_days: float) -> threading.Thread | None:
+    """Prune the change log now and then once a day in a daemon thread (0 keeps everything)."""
+    if retention_days <= 0:
+        return None
+    def loop() -> None:
+        while True:
+            try:
+                with session_factory() as db:
+                    prune_changes(db, retention_days)
+            except Exception:
+                logger.exception("Change log pruning failed")
+            time.sleep(24 * 60 * 60)
+
+    thread = threading.Thread(target=loop, name="change-log-pruner", daemon=True)
+    thread.start()
+    return thread
+
+
+for _model in TRACKED:
+    @event.listens_for(_model, "after_insert")
+    @event.listens_for(_model, "after_update")
+    def _changed(mapper, connection, target) -> None:
+        log_changes(connection, [_entry(target, deleted=False)])
+
+    @event.listens_for(_model, "after_delete")
+    def _removed(mapper, connection, target) -> None:
+        log_changes(connection, [_entry(target, deleted=True)])
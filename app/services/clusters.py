@@ -0,0 +1,149 @@
+"""
+Marker clustering for the map screen.
+
+For every zoom level below CLUSTER_MAX_ZOOM the trails are bucketed into a grid on top of the
+web mercator map tiles (CELLS_PER_TILE x CELLS_PER_TILE cells per 256px tile), keeping only a
+count and the lat/lon sums per cell. A viewport request then just reads the cells inside its
+bbox, so a dense metro area costs one marker per cell instead of one per trail.
+
+The grids are built once from the trails table and rebuilt lazily after a trail is added,
+moved or removed (see the ORM hooks at the bottom). They are dropped once that change has
+committed, so a rebuild never reads the trails table from before it.
+"""
+
+from math import log, tan, cos, pi, radians
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Trail
+from app.services.after_commit import on_commit
+
+CLUSTER_MAX_ZOOM = 13  # at this zoom and closer the map gets individual trails
+CELLS_PER_TILE = 4  # 64px cells on 256px tiles
+MAX_LAT = 85.05112878  # web mercator cuts off here
+
+# zoom -> {(cell_x, cell_y): [count, lat_sum, lon_sum, trail_id of the first trail]}
+Grid = Dict[Tuple[int, int], list]
+
+
+def _grid_size(zoom: int) -> int:
+    return (1 << zoom) * CELLS_PER_TILE
+
+
+def _cell_x(lon: float, size: int) -> int:
+    return min(int((lon + 180.0) / 360.0 * size), size - 1)
+
+
+def _cell_y(lat: float, size: int) -> int:
+    lat = max(min(lat, MAX_LAT), -MAX_LAT)
+    r = radians(lat)
+    y = (1.0 - log(tan(r) + 1.0 / cos(r)) / pi) / 2.0 * size
+    return max(min(int(y), size - 1), 0)
+
+
+class ClusterIndex:
+    def __init__(self) -> None:
+        self._grids: Optional[List[Grid]] = None
+        self._generation = 0  # bumped on every invalidate so a build racing a write is not kept
+        self._lock = Lock()
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._grids = None
+
+    def _build(self, db: Session) -> List[Grid]:
+        grids: List[Grid] = [{} for _ in range(CLUSTER_MAX_ZOOM)]
+        rows = (
+            db.query(Trail.id, Trail.lat, Trail.lon)
+            .filter(Trail.lat.isnot(None), Trail.lon.isnot(None))
+            .all()
+        )
+        for trail_id, lat, lon in rows:
+            for zoom, grid in enumerate(grids):
+                size = _grid_size(zoom)
+                key = (_cell_x(lon, size), _cell_y(lat, size))
+                cell = grid.get(key)
+                if cell is None:
+                    grid[key] = [1, lat, lon, trail_id]
+                else:
+                    cell[0] += 1
+                    cell[1] += lat
+                    cell[2] += lon
+        return grids
+
+    def _get_grids(self, db: Session) -> List[Grid]:
+        grids = self._grids
+        if grids is None:
+            with self._lock:
+                grids = self._grids
+                if grids is None:
+                    generation = self._generation
+                    grids = self._build(db)
+                    if generation == self._generation:
+                        self._grids = grids
+        return grids
+
+    def clusters(
+        self,
+        db: Session,
+        zoom: int,
+        min_lon: float,
+        min_lat: float,
+        max_lon: float,
+        max_lat: float,
+    ) -> List[Tuple[float, float, int, Optional[int]]]:
+        """
+        (lat, lon, count, trail_id) per non-empty cell inside the bbox at this zoom.
+        trail_id is only set when the cell holds a single trail.
+        min_lon > max_lon means the bbox crosses the antimeridian.
+        """
+        grid = self._get_grids(db)[zoom]
+        size = _grid_size(zoom)
+
+        # mercator y grows southwards, so the max latitude gives the smallest y
+        y_lo, y_hi = _cell_y(max_lat, size), _cell_y(min_lat, size)
+        if min_lon <= max_lon:
+            x_spans = [(_cell_x(min_lon, size), _cell_x(max_lon, size))]
+        else:
+            x_spans = [(_cell_x(min_lon, size), size - 1), (0, _cell_x(max_lon, size))]
+
+        cells: List[list] = []
+        span_area = sum(hi - lo + 1 for lo, hi in x_spans) * (y_hi - y_lo + 1)
+        if span_area <= len(grid):
+            # small viewport: look the cells up directly
+            for x_lo, x_hi in x_spans:
+                for x in range(x_lo, x_hi + 1):
+                    for y in range(y_lo, y_hi + 1):
+                        cell = grid.get((x, y))
+                        if cell is not None:
+                            cells.append(cell)
+        else:
+            # big viewport: cheaper to walk the occupied cells
+            for (x, y), cell in grid.items():
+                if y_lo <= y <= y_hi and any(lo <= x <= hi for lo, hi in x_spans):
+                    cells.append(cell)
+
+        return [
+            (lat_sum / count, lon_sum / count, count, trail_id if count == 1 else None)
+            for count, lat_sum, lon_sum, trail_id in cells
+        ]
+
+
+trail_clusters = ClusterIndex()
+
+
+# rebuild the grids after trails are added/removed or change position (once committed)
+@event.listens_for(Trail, "after_insert")
+@event.listens_for(Trail, "after_delete")
+def _trail_added_or_removed(mapper, connection, target: Trail) -> None:
+    on_commit(target, "clusters", trail_clusters.invalidate)
+
+
+@event.listens_for(Trail, "after_update")
+def _trail_updated(mapper, connection, target: Trail) -> None:
+    state = inspect(target)
+    if state.attrs.lat.history.has_changes() or state.attrs.lon.history.has_changes():
+        on_commit(target, "clusters", trail_clusters.invalidate)
@@ -0,0 +1,84 @@
+"""
+Connection pool metrics.
+
+Every connection checked out of an engine's pool is counted (db.checkouts) and the time until it
+goes back is timed (db.connection_held). RequestCheckouts also follows each HTTP request, so
+/metrics shows how many requests did 0, 1, 2 or 3+ checkouts (db.checkouts_per_request.N) and how
+many connections they held at the same time at most (db.peak_connections_per_request.N).
+
+A session can check out again after a commit (commit then refresh = 2 checkouts), but with the
+shared get_db a request should never hold more than one connection at once: a peak of 2 or more
+means something opened its own session next to the request's.
+
+pool_status() is the pool's current size/usage for /metrics.
+"""
+
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.services import metrics
+
+# [checkouts, held now, most held at once] of the current request, a list so threadpool copies
+# of the context share it
+_request_checkouts: ContextVar[Optional[List[int]]] = ContextVar("request_checkouts", default=None)
+
+
+def watch(engine: Engine) -> None:
+    """Count and time the checkouts of engine's pool (for async engines pass .sync_engine)."""
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+        metrics.increment("db.checkouts")
+        counter = _request_checkouts.get()
+        if counter is not None:
+            counter[0] += 1
+            counter[1] += 1
+            counter[2] = max(counter[2], counter[1])
+            connection_record.info["request"] = counter  # checkin may not see the request's context
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checked_out_at", None)
+        if started is not None:
+            metrics.observe("db.connection_held", time.perf_counter() - started)
+        counter = connection_record.info.pop("request", None)
+        if counter is not None:
+            counter[1] -= 1
+
+
+class RequestCheckouts:
+    """ASGI middleware counting pool checkouts per HTTP request."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        counter = [0, 0, 0]
+        token = _request_checkouts.set(counter)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_checkouts.reset(token)
+            metrics.increment(f"db.checkouts_per_request.{_bucket(counter[0])}")
+            metrics.increment(f"db.peak_connections_per_request.{_bucket(counter[2])}")
+
+
+def _bucket(n: int) -> str:
+    return str(n) if n < 3 else "3+"
+
+
+def pool_status(engine: Engine) -> dict:
+    pool = engine.pool
+    status = {"class": type(pool).__name__}
+    for name in ("size", "checkedout", "overflow", "checkedin"):
+        fn = getattr(pool, name, None)  # not every pool class has all of these
+        if fn is not None:
+            status[name] = fn()
+    return status
@@ -0,0 +1,90 @@
+"""
+Friends feed: posts of the people a user follows, newest first.
+
+Timelines are materialised in feed_entries. When a post is created, one INSERT ... SELECT copies
+its id into the timeline of every follower of the author (fan-out on write), so reading a
+page is a single range read of the (user_id, post_id) index. Post ids only go up, so ordering
+by post_id is ordering by creation time and it doubles as the page cursor.
+
+Accounts with more than FEED_FANOUT_MAX_FOLLOWERS followers would make every one of their
+posts write that many rows, so their posts are not fanned out and are marked that way
+(Post.fanned_out = False); a reader's page pulls those from the posts table instead (fan-out
+on read) and merges them in. The mark is per post, so posts made while an author was over the
+limit stay in feeds after the author drops below it, and the other way around.
+
+Following someone copies their latest posts into your timeline, unfollowing removes them.
+Both are safe to race with themselves: a duplicate follow is an IntegrityError on the
+(follower, followee) pair, and only the unfollow that actually deleted the row counts.
+"""
+
+from typing import List, Optional
+
+from sqlalchemy import delete, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import FeedEntry, Follow, Post, User
+
+
+def fans_out(followers_count: int) -> bool:
+    return followers_count <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def fan_out_post(db: Session, post: Post, author: User) -> None:
+    """Add a new (flushed) post to its author's followers' timelines, unless the author has too many."""
+    if not fans_out(author.followers_count or 0):
+        post.fanned_out = False
+        return
+    db.execute(
+        insert(FeedEntry).from_select(
+            ["user_id", "post_id", "author_id"],
+            select(Follow.follower_id, literal(post.id), literal(post.user_id)).where(Follow.followee_id == post.user_id),
+        )
+    )
+
+
+def follow(db: Session, follower_id: int, followee: User) -> None:
+    """Raises IntegrityError (on flush) if follower_id already follows followee."""
+    db.add(Follow(follower_id=follower_id, followee_id=followee.id))
+    db.flush()
+    db.execute(update(User).where(User.id == followee.id).values(followers_count=User.followers_count + 1))
+    # catch the timeline up with their recent fanned out posts (the others are merged in on read)
+    recent = (
+        select(literal(follower_id), Post.id, Post.user_id)
+        .where(Post.user_id == followee.id, Post.fanned_out.is_(True))
+        .order_by(Post.id.desc())
+        .limit(settings.FEED_BACKFILL_POSTS)
+    )
+    db.execute(insert(FeedEntry).from_select(["user_id", "post_id", "author_id"], recent))
+
+
+def unfollow(db: Session, follower_id: int, followee_id: int) -> bool:
+    """Returns False if there was nothing to unfollow (e.g. a concurrent unfollow won)."""
+    deleted = db.execute(
+        delete(Follow).where(Follow.follower_id == follower_id, Follow.followee_id == followee_id)
+    ).rowcount
+    if not deleted:
+        return False
+    db.execute(update(User).where(User.id == followee_id).values(followers_count=User.followers_count - 1))
+    db.execute(delete(FeedEntry).where(FeedEntry.user_id == follower_id, FeedEntry.author_id == followee_id))
+    return True
+
+
+def timeline_post_ids(db: Session, user_id: int, before: Optional[int], limit: int) -> List[int]:
+    """Up to limit post ids of the user's Friends feed, newest first, older than post id 'before'."""
+    q = select(FeedEntry.post_id).where(FeedEntry.user_id == user_id)
+    if before is not None:
+        q = q.where(FeedEntry.post_id < before)
+    ids = set(db.scalars(q.order_by(FeedEntry.post_id.desc()).limit(limit)))
+
+    # posts of followed accounts that weren't fanned out (uses ix_posts_not_fanned_out)
+    pulled = (
+        select(Post.id)
+        .join(Follow, Follow.followee_id == Post.user_id)
+        .where(Follow.follower_id == user_id, Post.fanned_out == False)  # noqa: E712, "= 0" matches the partial index
+    )
+    if before is not None:
+        pulled = pulled.where(Post.id < before)
+    ids.update(db.scalars(pulled.order_by(Post.id.desc()).limit(limit)))
+
+    return sorted(ids, reverse=True)[:limit]
@@ -0,0 +1,276 @@
+"""
+Geo helpers for nearby lookups.
+
+- haversine_km() gives the great circle distance between two points
+- The globe is split into a fixed grid of CELL_DEG x CELL_DEG cells. Each trail stores
+  the id of the cell it sits in (Trail.geo_cell, indexed), so a nearby query only has to
+  look at the cells covering the search circle instead of every trail in the table.
+
+Cell ids are row * GRID_COLS + col, so the cells of one grid row are contiguous and
+a whole row of the search area turns into a single BETWEEN on the index.
+
+Closest-first lookups (nearest) walk outwards ring by ring over the same grid and stop as
+soon as k trails are found that are closer than anything in the rings not scanned yet.
+
+Nearby queries also push a lat/lon bounding box of the radius into SQL, and the rows that
+survive get their distances computed in one NumPy batch (distances_km / within_radius).
+"""
+
+from math import radians, degrees, sin, cos, asin, sqrt
+from typing import Callable, List, Sequence, Tuple, TypeVar
+
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+T = TypeVar("T")
+
+EARTH_RADIUS_KM = 6371.0
+
+CELL_DEG = 0.25  # about 28 km tall, so a 50 km radius touches roughly 5x5 cells
+GRID_COLS = int(360 / CELL_DEG)
+GRID_ROWS = int(180 / CELL_DEG)
+
+# SQLite caps expression depth, so long lists of cell ranges are split over several queries
+MAX_RANGES_PER_QUERY = 200
+
+
+# Haversine formula in KM for nearby filtering -- gets nearby between TWO points
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # Compute great circle distance between two (lat,lon) points in kilometers.
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def cell_row(lat: float) -> int:
+    return min(max(int((lat + 90.0) // CELL_DEG), 0), GRID_ROWS - 1)
+
+
+def cell_col(lon: float) -> int:
+    # wraps so that -180 and 180 land in the same column
+    return int(((lon + 180.0) % 360.0) // CELL_DEG) % GRID_COLS
+
+
+def cell_id(lat: float | None, lon: float | None) -> int | None:
+    """Grid cell for a point, or None if the point has no coordinates."""
+    if lat is None or lon is None:
+        return None
+    return cell_row(float(lat)) * GRID_COLS + cell_col(float(lon))
+
+
+def cell_ranges(lat: float, lon: float, radius_km: float) -> List[Tuple[int, int]]:
+    """
+    Inclusive (low, high) cell id ranges covering a circle around (lat, lon).
+    The ranges over-cover a little, the exact haversine check is still done afterwards.
+    """
+    dlat = degrees(radius_km / EARTH_RADIUS_KM)
+    row_lo = cell_row(max(lat - dlat, -90.0))
+    row_hi = cell_row(min(lat + dlat, 90.0))
+
+    # the circle is widest (in degrees of lon) at the latitude closest to a pole
+    widest_lat = min(abs(lat) + dlat, 90.0)
+    full_rows = widest_lat >= 89.9
+    if not full_rows:
+        dlon = degrees(radius_km / (EARTH_RADIUS_KM * cos(radians(widest_lat))))
+        full_rows = dlon >= 180.0
+
+    ranges: List[Tuple[int, int]] = []
+    for row in range(row_lo, row_hi + 1):
+        base = row * GRID_COLS
+        if full_rows:
+            ranges.append((base, base + GRID_COLS - 1))
+            continue
+        col_lo = cell_col(lon - dlon)
+        col_hi = cell_col(lon + dlon)
+        if col_lo <= col_hi:
+            ranges.append((base + col_lo, base + col_hi))
+        else:  # the circle crosses the antimeridian
+            ranges.append((base + col_lo, base + GRID_COLS - 1))
+            ranges.append((base, base + col_hi))
+
+    # merge touching ranges (full rows end up as one big range)
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in ranges:
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def cell_filter(column, lat: float, lon: float, radius_km: float):
+    """SQL condition that keeps rows whose cell column is inside the search circle's cells."""
+    return or_(*[column.between(lo, hi) for lo, hi in cell_ranges(lat, lon, radius_km)])
+
+
+def band_ranges(center_row: int, center_col: int, ring_lo: int, ring_hi: int) -> List[Tuple[int, int]]:
+    """
+    Inclusive cell id ranges for the square band of cells that are ring_lo..ring_hi cells
+    away from the center cell (ring 0 is the center cell itself).
+    """
+    ranges: List[Tuple[int, int]] = []
+    full_width = 2 * ring_hi + 1 >= GRID_COLS
+
+    def add_cols(row: int, col_lo: int, col_hi: int) -> None:
+        base = row * GRID_COLS
+        if full_width:
+            ranges.append((base, base + GRID_COLS - 1))
+            return
+        lo, hi = col_lo % GRID_COLS, col_hi % GRID_COLS
+        if lo <= hi:
+            ranges.append((base + lo, base + hi))
+        else:  # wraps around the antimeridian
+            ranges.append((base + lo, base + GRID_COLS - 1))
+            ranges.append((base, base + hi))
+
+    for row in range(max(center_row - ring_hi, 0), min(center_row + ring_hi, GRID_ROWS - 1) + 1):
+        if abs(row - center_row) >= ring_lo or full_width:
+            add_cols(row, center_col - ring_hi, center_col + ring_hi)
+        else:  # the inner rings of this row were already scanned, only take both ends
+            add_cols(row, center_col - ring_hi, center_col - ring_lo)
+            add_cols(row, center_col + ring_lo, center_col + ring_hi)
+    return ranges
+
+
+def ring_covered_km(lat: float, lon: float, ring: int) -> float:
+    """
+    After scanning rings 0..ring around the cell of (lat, lon), every point closer than this
+    distance has been seen. It is the distance from the point to the nearest edge of the
+    scanned block of cells.
+    """
+    row, col = cell_row(lat), cell_col(lon)
+    edges: List[float] = []
+
+    # north/south edges (nothing lies beyond the poles)
+    if row - ring > 0:
+        edges.append(radians(lat - ((row - ring) * CELL_DEG - 90.0)) * EARTH_RADIUS_KM)
+    if row + ring < GRID_ROWS - 1:
+        edges.append(radians((row + ring + 1) * CELL_DEG - 90.0 - lat) * EARTH_RADIUS_KM)
+
+    # east/west edges: distance to a meridian dlon away is asin(sin(dlon) * cos(lat))
+    if 2 * ring + 1 < GRID_COLS:
+        lon0 = (lon + 180.0) % 360.0
+        for dlon in (lon0 - (col - ring) * CELL_DEG, (col + ring + 1) * CELL_DEG - lon0):
+            dlon = min(dlon, 90.0)
+            edges.append(asin(sin(radians(dlon)) * cos(radians(lat))) * EARTH_RADIUS_KM)
+
+    return min(edges) if edges else float("inf")
+
+
+def nearest(
+    query,
+    cell_column,
+    lat: float,
+    lon: float,
+    k: int,
+    max_km: float,
+    coords: Callable[[T], Tuple[float, float]] = lambda r: (r.lat, r.lon),
+) -> List[Tuple[T, float]]:
+    """
+    Up to k rows of `query` closest to (lat, lon) and within max_km, closest first.
+
+    Rings of grid cells are loaded from the inside out; the search stops once k rows are closer
+    than ring_covered_km (nothing unscanned can beat them) or the rings pass max_km.
+    """
+    center_row, center_col = cell_row(lat), cell_col(lon)
+    found: List[Tuple[T, float]] = []
+
+    # rings are scanned in bands that double in width (0, 1, 2-3, 4-7, ...) so sparse areas
+    # take a handful of queries instead of one per ring
+    ring_lo, ring_hi = 0, 0
+    while True:
+        ranges = band_ranges(center_row, center_col, ring_lo, ring_hi)
+        for i in range(0, len(ranges), MAX_RANGES_PER_QUERY):
+            chunk = ranges[i:i + MAX_RANGES_PER_QUERY]
+            rows = query.filter(or_(*[cell_column.between(lo, hi) for lo, hi in chunk])).all()
+            found.extend(within_radius(rows, lat, lon, max_km, coords))
+
+        covered = ring_covered_km(lat, lon, ring_hi)
+        found.sort(key=lambda pair: pair[1])
+        if covered >= max_km:
+            break
+        if len(found) >= k and found[k - 1][1] <= covered:
+            break
+        ring_lo, ring_hi = ring_hi + 1, 2 * ring_hi + 1
+
+    return found[:k]
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    (min_lat, max_lat, min_lon, max_lon) that contains the whole search circle.
+    min_lon > max_lon means the box wraps around the antimeridian.
+    """
+    dlat = degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    widest_lat = max(abs(min_lat), abs(max_lat))
+    if widest_lat >= 89.9:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = degrees(radius_km / (EARTH_RADIUS_KM * cos(radians(widest_lat))))
+    if dlon >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+
+    min_lon = ((lon - dlon + 180.0) % 360.0) - 180.0
+    max_lon = ((lon + dlon + 180.0) % 360.0) - 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def bbox_filter(lat_column, lon_column, lat: float, lon: float, radius_km: float):
+    """SQL condition keeping rows inside the bounding box of the search circle."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    lat_cond = lat_column.between(min_lat, max_lat)
+    if min_lon <= max_lon:
+        return and_(lat_cond, lon_column.between(min_lon, max_lon))
+    return and_(lat_cond, or_(lon_column >= min_lon, lon_column <= max_lon))
+
+
+def distances_km(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+    """Vectorized haversine from one point to many points, in kilometers."""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def within_radius(
+    rows: Sequence[T],
+    lat: float,
+    lon: float,
+    radius_km: float,
+    coords: Callable[[T], Tuple[float, float]] = lambda r: (r.lat, r.lon),
+) -> List[Tuple[T, float]]:
+    """
+    Keep the rows that are within radius_km of (lat, lon), paired with their distance.
+    All distances are computed in one batch instead of one haversine call per row.
+    """
+    if not rows:
+        return []
+    points = np.array([coords(r) for r in rows], dtype=np.float64)
+    dists = distances_km(lat, lon, points[:, 0], points[:, 1])
+    keep = np.flatnonzero(dists <= radius_km)
+    return [(rows[i], float(dists[i])) for i in keep]
+
+
+def backfill_trail_cells(db: Session) -> int:
+    """
+    Fill geo_cell for trails that have coordinates but no cell yet
+    (rows written before the column existed). Returns how many were updated.
+    """
+    from app.models import Trail
+
+    trails = (
+        db.query(Trail)
+        .filter(Trail.geo_cell.is_(None), Trail.lat.isnot(None), Trail.lon.isnot(None))
+        .all()
+    )
+    for t in trails:
+        t.geo_cell = cell_id(t.lat, t.lon)
+    if trails:
+        db.commit()
+    return len(trails)
@@ -0,0 +1,82 @@
+"""
+HTTP caching for read endpoints.
+
+cached_json() serializes a route's result the same way response_model would, derives an ETag
+from a hash of the body, and answers 304 Not Modified (no body) when the client's
+If-None-Match already has that ETag. Every response carries a Cache-Control policy so the app
+can reuse a fresh copy without asking at all, and revalidate cheaply once it goes stale.
+
+Hashing the body instead of a row version works for any response (lists, joined data, computed
+fields like distance_km) and can't go out of sync with what the client actually got.
+
+/media is handled by StaticFiles, which already sends ETag / Last-Modified and answers 304;
+MediaFiles (services/media.py) only adds the Cache-Control part.
+"""
+
+import hashlib
+from functools import lru_cache
+from typing import Any
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+# Cache-Control policies, roughly by how often the data changes
+TRAIL_CACHE = "public, max-age=60"  # ratings move with every review
+TRAIL_LIST_CACHE = "public, max-age=30"
+PARK_CACHE = "public, max-age=3600"  # only changes on an NPS import
+PHOTO_LIST_CACHE = "public, max-age=60"
+MEDIA_CACHE = "public, max-age=86400"  # files outside blobs/, still revalidated by ETag
+
+
+@lru_cache(maxsize=None)
+def _adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # a list of tags, weak ones (W/"...") compare equal for GET
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags
+
+
+def json_response(response: Response, model: Any, content: Any) -> Response:
+    """
+    content validated against model and serialized the way response_model would, keeping the
+    headers a route set on its injected response. For run_read routes, which serialize pages
+    through db.offload() instead of leaving it to FastAPI on the event loop.
+    """
+    adapter = _adapter(model)
+    out = Response(content=adapter.dump_json(adapter.validate_python(content, from_attributes=True)), media_type="application/json")
+    out.headers.raw.extend(response.headers.raw)
+    return out
+
+
+def cached_json(request: Request, response: Response, model: Any, content: Any, cache_control: str) -> Response:
+    """
+    Return content (validated against model, e.g. List[schemas.TrailOut]) as JSON with an ETag
+    and cache_control, or an empty 304 if the client already has it. Headers a route set on its
+    injected response (like X-Next-Cursor) are kept.
+    """
+    adapter = _adapter(model)
+    body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+    # the cursor header is part of what the client caches, so it's part of the tag too
+    hashed = body + b"\n" + "\n".join(f"{k}:{v}" for k, v in response.headers.items()).encode()
+    etag = make_etag(hashed)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        out = Response(status_code=304)
+    else:
+        out = Response(content=body, media_type="application/json")
+    out.headers.raw.extend(response.headers.raw)
+    out.headers["ETag"] = etag
+    out.headers["Cache-Control"] = cache_control
+    return out
@@ -0,0 +1,216 @@
+"""
+Storing uploaded photos on disk.
+
+Photos are content addressed: a file is stored once under media/blobs/<aa>/<sha256><ext>, where
+<aa> is the first two hex digits of its SHA-256 (keeps directories small). Uploading the same
+image again costs nothing extra and two uploads can never overwrite each other. A file is kept
+as long as some Photos row points at it (same file_path), see release_blob().
+
+stage_upload() streams an upload into a temp file in fixed size chunks instead of reading the
+whole image into memory, hashes it while it streams and refuses anything bigger than the
+configured max. store_blob() then renames it to its blob path (or drops it if that blob already
+exists). Storing the blob and committing the row that points at it happen under blob_lock, and
+so does the check-and-delete after a photo is deleted, so a delete can't remove a blob that a
+concurrent upload of the same image has just started using. The lock is per process.
+
+stage_upload() only sees the file once Starlette has parsed the multipart form, which spools the
+whole request body to disk first. UploadSizeLimit sits in front of that: it answers 413 from the
+Content-Length header before the body is read, and stops a body without one (or a lying one) as
+soon as it grows past the limit.
+
+Since a blob path never changes content, MediaFiles serves blobs with immutable cache headers
+(other files get a plain max-age, StaticFiles does the ETag / 304 part).
+
+Called from the sync upload handler, so it runs in FastAPI's threadpool and not on the event loop.
+"""
+
+import hashlib
+import mimetypes
+import os
+import pathlib
+import re
+import tempfile
+import threading
+from typing import BinaryIO, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import Photos
+from app.services.http_cache import MEDIA_CACHE
+
+MEDIA_ROOT = pathlib.Path("media")
+BLOB_DIR = "blobs"
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# multipart boundaries, part headers and small fields (the caption) on top of the file itself
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def blob_path(content_hash: str, ext: str) -> str:
+    """Path of a blob relative to media/."""
+    return f"{BLOB_DIR}/{content_hash[:2]}/{content_hash}{ext}"
+
+
+def image_extension(content_type: Optional[str], filename: Optional[str]) -> str:
+    """A safe file extension for an upload, so /media serves it with the right content type."""
+    ext = mimetypes.guess_extension(content_type or "") or pathlib.Path(filename or "").suffix
+    ext = ext.lower()
+    if ext == ".jpe":
+        ext = ".jpg"
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,5}", ext) else ""
+
+
+# held while a blob is stored until its row is committed, and while unused files are removed
+blob_lock = threading.RLock()  # reentrant: the upload commits (and so runs after_commit) while holding it
+
+# session.info key: files of photos deleted in the session's current transaction
+_RELEASED = "media.released"
+
+
+def too_large_detail(max_bytes: int) -> str:
+    return f"Image is too large (max {max_bytes} bytes)"
+
+
+class UploadSizeLimit:
+    """ASGI middleware refusing POST bodies bigger than max_bytes (+ form overhead) on paths matching path_pattern."""
+
+    def __init__(self, app, max_bytes: int, path_pattern: str) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+        self.max_body = max_bytes + FORM_OVERHEAD_BYTES
+        self.path = re.compile(path_pattern)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not self.path.fullmatch(scope["path"]):
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_body:
+            response = JSONResponse({"detail": too_large_detail(self.max_bytes)}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # raised inside the form parsing, FastAPI passes HTTPException through as the response
+                    raise HTTPException(status_code=413, detail=too_large_detail(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def stage_upload(src: BinaryIO, max_bytes: int, chunk_size: int) -> Tuple[str, str, int]:
+    """
+    Copy src into a temp file. Returns (temp file path, sha256 hex digest, size in bytes).
+    Raises UploadTooLarge (and leaves nothing behind) when src is bigger than max_bytes.
+    """
+    incoming = MEDIA_ROOT / BLOB_DIR / ".incoming"
+    incoming.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=incoming, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        discard(tmp_path)
+        raise
+
+    return tmp_path, digest.hexdigest(), size
+
+
+def store_blob(tmp_path: str, content_hash: str, ext: str) -> str:
+    """Move a staged upload to its blob path, returns the path relative to media/. Hold blob_lock."""
+    dest_rel = blob_path(content_hash, ext)
+    dest_abs = MEDIA_ROOT / dest_rel
+    if dest_abs.exists():
+        discard(tmp_path)  # already stored, nothing to write
+    else:
+        dest_abs.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, dest_abs)  # atomic on the same filesystem
+    return dest_rel
+
+
+def discard(path) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def release_blob(db: Session, photo: Photos) -> None:
+    """
+    Call when deleting a Photos row: once the session commits, its file and resized copies are
+    removed unless another photo still points at the same file. Nothing happens on rollback.
+    """
+    db.info.setdefault(_RELEASED, []).append((photo.file_path, list((photo.variants or {}).values())))
+
+
+def remove_unused_blob(db: Session, file_path: str, variants: Iterable[str] = ()) -> bool:
+    """
+    Remove a blob and its resized copies if no Photos row points at file_path any more.
+    Returns False (and keeps everything) if one does. Hold blob_lock.
+    """
+    if db.query(Photos.id).filter(Photos.file_path == file_path).first():
+        return False  # same image uploaded again, its row uses these files
+    discard(MEDIA_ROOT / file_path)
+
+    # the copies are named after the hash (<hash>_<size>.jpg), and a variant job may have written
+    # them after the row listing them was read, so look for them on disk as well. The same bytes
+    # stored with another extension share them.
+    blob = pathlib.PurePosixPath(file_path)
+    if db.query(Photos.id).filter(Photos.file_path.like(f"{blob.parent}/{blob.stem}%")).first():
+        return True
+    copies = {str(blob.parent / p.name) for p in (MEDIA_ROOT / blob.parent).glob(f"{blob.stem}_*.jpg")}
+    for rel in copies.union(variants):
+        discard(MEDIA_ROOT / rel)
+    return True
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_released(session: Session) -> None:
+    released = session.info.pop(_RELEASED, None)
+    if not released:
+        return
+    # the committed session can't run queries any more, so check with a fresh one
+    with blob_lock, Session(bind=session.get_bind()) as check:
+        for file_path, variants in released:
+            remove_unused_blob(check, file_path, variants)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_released(session: Session, previous_transaction) -> None:
+    if not previous_transaction.nested:
+        session.info.pop(_RELEASED, None)
+
+
+class MediaFiles(StaticFiles):
+    # /media, with blobs marked immutable so clients never revalidate them
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE if path.startswith(f"{BLOB_DIR}/") else MEDIA_CACHE
+        return response
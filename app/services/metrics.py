@@ -0,0 +1,64 @@
+"""
+In-process metrics, served as JSON at GET /metrics.
+
+Timers keep a count, total, max and a small latency histogram per name; counters are plain
+running totals. Everything is per process and resets on restart, it's for spotting trouble
+(slow password hashing, rejected requests), not for long term storage.
+"""
+
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator
+
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_lock = Lock()
+_timers: Dict[str, dict] = {}
+_counters: Dict[str, int] = {}
+
+
+def observe(name: str, seconds: float) -> None:
+    ms = seconds * 1000.0
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = _timers[name] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(BUCKETS_MS) + 1)}
+        timer["count"] += 1
+        timer["total_ms"] += ms
+        timer["max_ms"] = max(timer["max_ms"], ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                timer["buckets"][i] += 1
+                break
+        else:
+            timer["buckets"][-1] += 1
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def increment(name: str, by: int = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + by
+
+
+def snapshot() -> dict:
+    with _lock:
+        timers = {}
+        for name, t in _timers.items():
+            labels = [f"le_{b}ms" for b in BUCKETS_MS] + ["inf"]
+            timers[name] = {
+                "count": t["count"],
+                "avg_ms": round(t["total_ms"] / t["count"], 3) if t["count"] else 0.0,
+                "max_ms": round(t["max_ms"], 3),
+                "histogram": dict(zip(labels, t["buckets"])),
+            }
+        return {"timers": timers, "counters": dict(_counters)}
@@ -0,0 +1,181 @@
+"""
+Offline bundle: everything the app needs for a user's saved trails in one zip.
+
+bundle.json holds every trail the user saved for offline use with its park, the top reviews,
+the user's own notes and the trail's photos; thumbs/ holds the photo thumbnails (stored by
+content hash, so a photo used on several trails is in there once).
+
+Building the zip (reading and packing the thumbnails) is the expensive part, so it is done
+once per content: the DB rows going into the bundle are serialized first, the hash of that
+JSON is the bundle's fingerprint, and bundles/<user id>/<fingerprint>.zip is reused
+until anything in it (a trail, park, review, note, photo, or the saved list itself) changes.
+The fingerprint doubles as the download's ETag.
+
+Bundles hold private notes, so they live outside media/ (which is served to anyone).
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+import zipfile
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased
+
+from app import schemas
+from app.models import Note, OfflineDownload, Park, Photos, Review, Trail
+from app.services.media import MEDIA_ROOT
+
+BUNDLE_ROOT = pathlib.Path("bundles")
+BUNDLE_FORMAT = 1  # bump when the layout of bundle.json changes
+REVIEWS_PER_TRAIL = 20
+PHOTOS_PER_TRAIL = 30
+# older bundles are only removed once they haven't been handed out for this long, so a
+# download that is still starting or streaming one never has it deleted underneath it
+STALE_BUNDLE_SECONDS = 15 * 60
+
+
+def _jsonable(model) -> Dict[str, Any]:
+    return model.model_dump(mode="json")
+
+
+def top_per_trail(db: Session, model, trail_ids: List[int], order_by: list, limit: int) -> Dict[int, list]:
+    """The first `limit` rows of model per trail, in order_by order: one query for all trails."""
+    if not trail_ids:
+        return {}
+    rank = func.row_number().over(partition_by=model.trail_id, order_by=order_by).label("rank")
+    ranked = select(model, rank).where(model.trail_id.in_(trail_ids)).subquery()
+    row = aliased(model, ranked)
+    grouped: Dict[int, list] = {}
+    for item in db.query(row).filter(ranked.c.rank <= limit).order_by(ranked.c.trail_id, ranked.c.rank):
+        grouped.setdefault(item.trail_id, []).append(item)
+    return grouped
+
+
+def collect(db: Session, user_id: int) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Contents of a user's bundle: (bundle.json data, {name in zip: thumbnail path under media/}).
+    Only rows, no files are read here.
+    """
+    trails = (
+        db.query(Trail)
+        .join(OfflineDownload, OfflineDownload.trail_id == Trail.id)
+        .filter(OfflineDownload.user_id == user_id)
+        .order_by(Trail.name.asc(), Trail.id)
+        .all()
+    )
+    trail_ids = [t.id for t in trails]
+    park_ids = {t.park_id for t in trails if t.park_id is not None}
+    parks = {p.id: p for p in db.query(Park).filter(Park.id.in_(park_ids))} if park_ids else {}
+
+    notes: Dict[int, List[Note]] = {}
+    if trail_ids:
+        for note in (
+            db.query(Note)
+            .filter(Note.user_id == user_id, Note.trail_id.in_(trail_ids))
+            .order_by(Note.is_pinned.desc(), Note.created_at.desc(), Note.id.desc())
+        ):
+            notes.setdefault(note.trail_id, []).append(note)
+
+    # best first, newest first among equals (uses ix_reviews_trail_rating_created)
+    reviews = top_per_trail(
+        db, Review, trail_ids, [Review.rating.desc(), Review.created_at.desc(), Review.id.desc()], REVIEWS_PER_TRAIL
+    )
+    photos = top_per_trail(db, Photos, trail_ids, [Photos.created_at.desc(), Photos.id.desc()], PHOTOS_PER_TRAIL)
+
+    thumbs: Dict[str, str] = {}
+    out = []
+    for trail in trails:
+        photo_items = []
+        for photo in photos.get(trail.id, []):
+            thumb = (photo.variants or {}).get("thumb")
+            name = None
+            if thumb:  # originals are too big for a bundle, photos without a thumb yet go without
+                name = f"thumbs/{pathlib.PurePosixPath(thumb).name}"
+                thumbs[name] = thumb
+            photo_items.append({
+                "id": photo.id,
+                "user_id": photo.user_id,
+                "caption": photo.caption,
+                "created_at": photo.created_at.isoformat(),
+                "thumb": name,
+            })
+
+        park = parks.get(trail.park_id)
+        out.append({
+            "trail": _jsonable(schemas.TrailOut.model_validate(trail)),
+            "park": _jsonable(schemas.ParkOut.model_validate(park)) if park else None,
+            "reviews": [_jsonable(schemas.ReviewOut.model_validate(r)) for r in reviews.get(trail.id, [])],
+            "notes": [
+                {
+                    "id": n.id,
+                    "text": n.text,
+                    "is_pinned": n.is_pinned,
+                    "created_at": n.created_at.isoformat(),
+                    "updated_at": n.updated_at.isoformat(),
+                }
+                for n in notes.get(trail.id, [])
+            ],
+            "photos": photo_items,
+        })
+
+    return {"format": BUNDLE_FORMAT, "user_id": user_id, "trails": out}, thumbs
+
+
+def _write_zip(dest: pathlib.Path, manifest: bytes, thumbs: Dict[str, str]) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=dest.parent, suffix=".part")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp_path, "w") as zf:
+            zf.writestr("bundle.json", manifest, compress_type=zipfile.ZIP_DEFLATED)
+            for name, rel in sorted(thumbs.items()):
+                src = MEDIA_ROOT / rel
+                if src.exists():
+                    zf.write(src, name, compress_type=zipfile.ZIP_STORED)  # JPEGs don't deflate
+        os.replace(tmp_path, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def get_bundle(db: Session, user_id: int) -> Tuple[pathlib.Path, str]:
+    """
+    Path of the user's current bundle zip (built if needed) and its fingerprint.
+    When a new one is built, older bundles of the user not handed out in STALE_BUNDLE_SECONDS are removed.
+    """
+    data, thumbs = collect(db, user_id)
+    manifest = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+    fingerprint = hashlib.sha256(manifest).hexdigest()[:32]
+
+    user_dir = BUNDLE_ROOT / str(user_id)
+    dest = user_dir / f"{fingerprint}.zip"
+    if dest.exists():
+        try:
+            os.utime(dest)  # mtime = last handed out, see _remove_stale
+            return dest, fingerprint
+        except FileNotFoundError:
+            pass  # removed meanwhile, build it again
+
+    user_dir.mkdir(parents=True, exist_ok=True)
+    _write_zip(dest, manifest, thumbs)
+    _remove_stale(user_dir, dest)
+    return dest, fingerprint
+
+
+def _remove_stale(user_dir: pathlib.Path, current: pathlib.Path) -> None:
+    cutoff = time.time() - STALE_BUNDLE_SECONDS
+    for old in user_dir.glob("*.zip"):
+        if old == current:
+            continue
+        try:
+            if old.stat().st_mtime < cutoff:
+                old.unlink()
+        except FileNotFoundError:
+            pass
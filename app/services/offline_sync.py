@@ -0,0 +1,110 @@
+"""
+Delta sync for the offline copy on the phone.
+
+The client keeps the token of its last sync and asks for what changed since then. From the
+change log (services/changes.py) we work out:
+- trails the user saved since the token: sent whole (trail, park, top reviews, their notes,
+  photos), like in the offline bundle
+- trails the user un-saved, and saved trails that were deleted: listed in removed.trails
+- everything else logged for the user's saved trails (trail edits, new reviews and photos,
+  their own notes): the rows as they are now, or their ids in removed.* when they are gone
+
+No token, or one older than the pruned change log, gives everything with reset=True.
+The new token is the last logged seq at the start of the sync, so a change that lands while
+the sync runs is simply sent again next time.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from app import schemas
+from app.models import ChangeLog, Note, OfflineDownload, Park, Photos, Review, Trail
+from app.services.offline_bundle import PHOTOS_PER_TRAIL, REVIEWS_PER_TRAIL, top_per_trail
+from app.services.pagination import encode_cursor
+from app.services.photo_variants import photo_out
+
+SAVES = OfflineDownload.__tablename__
+
+
+def _trail_content(db: Session, user_id: int, trail_ids: Iterable[int], out: Dict[str, list]) -> None:
+    # everything about these trails, for trails that are new on the phone
+    trail_ids = sorted(trail_ids)
+    reviews = top_per_trail(
+        db, Review, trail_ids, [Review.rating.desc(), Review.created_at.desc(), Review.id.desc()], REVIEWS_PER_TRAIL
+    )
+    photos = top_per_trail(db, Photos, trail_ids, [Photos.created_at.desc(), Photos.id.desc()], PHOTOS_PER_TRAIL)
+    for trail_id in trail_ids:
+        out["reviews"] += reviews.get(trail_id, [])
+        out["photos"] += [photo_out(p) for p in photos.get(trail_id, [])]
+    if trail_ids:
+        out["trails"] += db.query(Trail).filter(Trail.id.in_(trail_ids)).order_by(Trail.name, Trail.id).all()
+        out["notes"] += (
+            db.query(Note)
+            .filter(Note.user_id == user_id, Note.trail_id.in_(trail_ids))
+            .order_by(Note.id)
+            .all()
+        )
+
+
+def _current(db: Session, model, ids: Set[int], *conds) -> tuple[list, List[int]]:
+    # (rows that still exist, ids of the ones that don't)
+    if not ids:
+        return [], []
+    rows = db.query(model).filter(model.id.in_(ids), *conds).order_by(model.id).all()
+    found = {row.id for row in rows}
+    return rows, sorted(ids - found)
+
+
+def sync(db: Session, user_id: int, since: Optional[int]) -> schemas.OfflineSyncOut:
+    head = db.scalar(select(func.max(ChangeLog.seq))) or 0
+    oldest = db.scalar(select(func.min(ChangeLog.seq)))
+    saved = set(db.scalars(select(OfflineDownload.trail_id).where(OfflineDownload.user_id == user_id)))
+
+    out: Dict[str, list] = {"trails": [], "reviews": [], "notes": [], "photos": []}
+    removed: Dict[str, list] = {"trails": [], "reviews": [], "notes": [], "photos": []}
+    reset = since is None or since > head or (oldest is not None and since < oldest - 1)
+    if reset:
+        _trail_content(db, user_id, saved, out)
+    else:
+        window = (ChangeLog.seq > since, ChangeLog.seq <= head)
+
+        toggled = set(db.scalars(
+            select(ChangeLog.trail_id).where(*window, ChangeLog.entity == SAVES, ChangeLog.user_id == user_id)
+        ))
+        added = toggled & saved
+        removed["trails"] += sorted(toggled - saved)
+        _trail_content(db, user_id, added, out)
+
+        watched = saved - added  # newly saved trails went out whole already
+        changed: Dict[str, Set[int]] = {}
+        if watched:
+            for entity, row_id in db.execute(
+                select(ChangeLog.entity, ChangeLog.row_id)
+                .where(
+                    *window,
+                    ChangeLog.entity != SAVES,
+                    ChangeLog.trail_id.in_(watched),
+                    or_(ChangeLog.user_id.is_(None), ChangeLog.user_id == user_id),  # other users' notes stay private
+                )
+                .distinct()
+            ):
+                changed.setdefault(entity, set()).add(row_id)
+
+        for key, model, conds in (
+            ("trails", Trail, ()),
+            ("reviews", Review, ()),
+            ("notes", Note, (Note.user_id == user_id,)),
+            ("photos", Photos, ()),
+        ):
+            rows, gone = _current(db, model, changed.get(model.__tablename__, set()), *conds)
+            out[key] += [photo_out(p) for p in rows] if model is Photos else rows
+            removed[key] += gone
+
+    park_ids = {t.park_id for t in out["trails"] if t.park_id is not None}
+    parks = db.query(Park).filter(Park.id.in_(park_ids)).order_by(Park.id).all() if park_ids else []
+    return schemas.OfflineSyncOut.model_validate(
+        {**out, "parks": parks, "removed": removed, "reset": reset, "token": encode_cursor([head])},
+        from_attributes=True,
+    )
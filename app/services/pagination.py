@@ -0,0 +1,93 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Instead of OFFSET, a page remembers the sort key of its last row and the next page asks for
+rows that sort after it ("WHERE (name, id) > (:last_name, :last_id)"), so page 50 costs the
+same as page 1 and rows inserted meanwhile don't shift pages around.
+
+The cursor handed to clients is opaque: the key values as JSON, base64url encoded (datetimes
+as ISO strings). decode_cursor(..., types) turns them back into the sort columns' own Python
+types, so the comparison is datetime vs timestamp on every database and not text vs text.
+Routers return it in the X-Next-Cursor response header (NEXT_CURSOR_HEADER) so the list
+response bodies stay the same; no header means there are no more rows.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int, types: Optional[Sequence[type]] = None) -> List[Any]:
+    """
+    The key values of a cursor. With types (one per value: int, float, str or datetime) every
+    value is checked and converted, so a tampered cursor is an InvalidCursor and not a DB error.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Invalid cursor")
+    if types is not None:
+        values = [_convert(value, t) for value, t in zip(values, types)]
+    return values
+
+
+def _convert(value: Any, t: type) -> Any:
+    if t is datetime:
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    elif t is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif isinstance(value, t) and not isinstance(value, bool):
+        return value
+    raise InvalidCursor("Invalid cursor")
+
+
+def after(keys: Sequence[Tuple[Any, Any, bool]]):
+    """
+    SQL condition for rows that sort after the cursor position.
+    keys: (column, cursor value, descending) in ORDER BY order, e.g. for ORDER BY name, id:
+    [(Park.name, "Acadia", False), (Park.id, 12, False)] -> name > 'Acadia' OR (name = 'Acadia' AND id > 12)
+    """
+    clauses = []
+    for i, (column, value, descending) in enumerate(keys):
+        equal = [col == val for col, val, _ in keys[:i]]
+        clauses.append(and_(*equal, column < value if descending else column > value))
+    return or_(*clauses)
+
+
+def scan_page(query, keys_for: Callable[[Any], Sequence[Tuple[Any, Any, bool]]], keep: Callable[[list], list], limit: int, batch: int = 200) -> list:
+    """
+    For pages that also need a filter only Python can do (exact distance): walk the already
+    ordered query in batches, keep(rows) picks the rows to return, until limit + 1 are found
+    (the extra one tells whether there is a next page) or the rows run out.
+    keys_for(row) gives the after() keys of a row, to continue the scan behind it.
+    """
+    page: list = []
+    scan = query
+    while True:
+        rows = scan.limit(batch).all()
+        page.extend(keep(rows))
+        if len(page) > limit or len(rows) < batch:
+            return page
+        scan = query.filter(after(keys_for(rows[-1])))
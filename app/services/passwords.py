@@ -0,0 +1,93 @@
+"""
+Password hashing off the request threads.
+
+PBKDF2 is deliberately slow, and running it inside the request thread let a burst of logins
+take every thread of FastAPI's threadpool. Hashing and verifying now run in a small process
+pool (PASSWORD_HASH_WORKERS). A request thread only waits for the result, and at most
+PASSWORD_HASH_MAX_PENDING operations may be queued or running at once; beyond that HashingBusy
+is raised (the auth router answers 503), so waiting logins can never pile up and block the
+threadpool for everyone else.
+
+The cost is PASSWORD_HASH_ROUNDS. Hashes made with a different number of rounds are flagged
+by passlib, and login swaps them for a fresh hash (verify_and_update), so changing the setting
+migrates users as they log in.
+
+Every operation is timed into the metrics (password.hash / password.verify) and rejected ones
+are counted (password.rejected).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from app.config import settings
+from app.services import metrics
+
+pwd_context = CryptContext( # pbkdf2 instead of bcrypt, bcrypt errors on passwords over 72 bytes
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=settings.PASSWORD_HASH_ROUNDS,
+    # any other round count counts as outdated, so it gets rehashed on login
+    pbkdf2_sha256__min_rounds=settings.PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__max_rounds=settings.PASSWORD_HASH_ROUNDS,
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
+_lock = Lock()
+
+
+class HashingBusy(Exception):
+    pass
+
+
+# these run in the worker processes
+def _hash(plain: str) -> str:
+    return pwd_context.hash(plain)
+
+
+def _verify_and_update(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain, hashed)
+
+
+def _run(name: str, fn, *args):
+    global _pool, _pending
+    with _lock:
+        if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            metrics.increment("password.rejected")
+            raise HashingBusy("Too many password operations in flight")
+        _pending += 1
+        if _pool is None and settings.PASSWORD_HASH_WORKERS > 0:
+            _pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+        pool = _pool
+    try:
+        with metrics.timed(name):
+            if pool is None:  # workers turned off: same limits, but in this thread
+                return fn(*args)
+            return pool.submit(fn, *args).result()
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def hash_password(plain: str) -> str:
+    return _run("password.hash", _hash, plain)
+
+
+def verify_password(plain: str, hashed: str) -> bool:
+    return _run("password.verify", _verify_and_update, plain, hashed)[0]
+
+
+def verify_and_update(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """(password ok, new hash if the stored one uses outdated settings else None)"""
+    return _run("password.verify", _verify_and_update, plain, hashed)
+
+
+def shutdown() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
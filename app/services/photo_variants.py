@@ -0,0 +1,143 @@
+"""
+Resized copies of trail photos.
+
+After an upload the original is handed to a ProcessPoolExecutor that writes a few JPEG
+variants next to it (thumb / card / full, see VARIANTS), so image decoding and resizing never
+runs in the API process. When a job finishes, the variant paths are saved on Photos.variants
+and PhotosOut hands out a URL per size. Until then (or if a job failed) every size falls back
+to the original file.
+
+Variants are named after the blob, so two uploads of the same image render to the same paths;
+each file is written to a temp file and renamed into place, so a reader never gets a half
+written JPEG. If the photo was deleted while its job ran, the job's files are removed again
+unless another photo uses the same blob.
+
+Pillow is optional: without it uploads still work, they just don't get variants.
+"""
+
+import logging
+import os
+import pathlib
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock
+from typing import Dict, Optional
+
+from app import schemas
+from app.config import settings
+from app.db import SessionLocal
+from app.models import Photos
+from app.services.media import MEDIA_ROOT, blob_lock, discard, remove_unused_blob
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# name -> (longest side in px, JPEG quality)
+VARIANTS: Dict[str, tuple[int, int]] = {
+    "thumb": (200, 70),
+    "card": (640, 80),
+    "full": (1600, 85),
+}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def render_variants(src_rel: str) -> Dict[str, str]:
+    """
+    Runs in a worker process: writes one JPEG per VARIANTS entry next to the original
+    (<name>_<variant>.jpg) and returns {variant: path relative to media/}.
+    """
+    src = MEDIA_ROOT / src_rel
+    out: Dict[str, str] = {}
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)  # phones store rotation in EXIF
+        img = img.convert("RGB")
+        for name, (side, quality) in VARIANTS.items():
+            copy = img.copy()
+            copy.thumbnail((side, side))  # keeps the aspect ratio, never upscales
+            dest_rel = pathlib.PurePosixPath(src_rel).with_name(f"{src.stem}_{name}.jpg")
+            _save_atomic(copy, MEDIA_ROOT / dest_rel, quality)
+            out[name] = str(dest_rel)
+    return out
+
+
+def _save_atomic(img, dest: pathlib.Path, quality: int) -> None:
+    # temp file in the same directory, so the rename is atomic
+    fd, tmp_path = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.stem}", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        discard(tmp_path)
+        raise
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.PHOTO_VARIANT_WORKERS)
+        return _pool
+
+
+def _record(photo_id: int, file_path: str, future: Future) -> None:
+    try:
+        variants = future.result()
+    except Exception:
+        logger.exception("Could not create variants for photo %s", photo_id)
+        return
+    with SessionLocal() as db:
+        photo = db.get(Photos, photo_id)
+        if photo is not None:
+            photo.variants = variants
+            db.commit()
+            return
+        # deleted while the job ran, after its delete already removed what it knew about
+        with blob_lock:
+            remove_unused_blob(db, file_path, variants.values())
+
+
+def schedule_variants(photo_id: int, file_path: str) -> bool:
+    """Queue variant generation for a stored photo. Returns False when it can't run (no Pillow)."""
+    if Image is None or settings.PHOTO_VARIANT_WORKERS <= 0:
+        return False
+    future = _get_pool().submit(render_variants, file_path)
+    future.add_done_callback(lambda f: _record(photo_id, file_path, f))
+    return True
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def variant_urls(photo: Photos) -> Dict[str, str]:
+    """URL per size for a photo, the original file standing in for sizes that aren't there (yet)."""
+    original = f"/media/{photo.file_path}"
+    variants = photo.variants or {}
+    return {name: f"/media/{variants[name]}" if name in variants else original for name in VARIANTS}
+
+
+def photo_out(photo: Photos) -> schemas.PhotosOut:
+    # url that gets pushed out for users, plus one per resized copy
+    urls = variant_urls(photo)
+    return schemas.PhotosOut(
+        id=photo.id,
+        trail_id=photo.trail_id,
+        user_id=photo.user_id,
+        caption=photo.caption,
+        created_at=photo.created_at,
+        url=f"/media/{photo.file_path}",
+        thumb_url=urls["thumb"],
+        card_url=urls["card"],
+        full_url=urls["full"],
+    )
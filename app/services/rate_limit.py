@@ -0,0 +1,209 @@
+"""
+Rate limiting for login attempts.
+
+Every login is counted per client IP and per email before anything else happens (no DB query,
+no password hashing), so brute forcing a password or hammering the server costs the attacker
+a cheap 429 instead of costing us PBKDF2 work. Only failed logins are meant to count: when the
+password checks out the attempt is taken back again (login_succeeded), so signing in from a
+few devices never uses up the allowance. Counting up front and taking it back afterwards (rather
+than counting after a failure) keeps parallel guesses from all passing the check at once.
+
+Counting uses a sliding window counter: per key only the number of attempts in the current and
+the previous fixed window is kept, and the previous one is weighted by how much of it still
+overlaps the sliding window. Three numbers per key, close enough to an exact sliding log.
+
+Where the counters live is pluggable (RATE_LIMIT_BACKEND):
+- "memory": a dict in this process, swept for stale keys every EVICT_EVERY_SECONDS
+- "sqlite": a small SQLite file (RATE_LIMIT_SQLITE_PATH) so several workers on one machine share
+  their counts; updates run in an IMMEDIATE transaction so concurrent workers don't lose hits
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+
+EVICT_EVERY_SECONDS = 60.0
+
+# (window number, hits in that window, hits in the window before)
+State = Tuple[int, int, int]
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _advance(state: Optional[State], window_no: int) -> State:
+    # move a stored state forward to the current window
+    if state is None:
+        return window_no, 0, 0
+    stored_no, current, previous = state
+    if stored_no == window_no:
+        return state
+    if stored_no == window_no - 1:
+        return window_no, 0, current
+    return window_no, 0, 0
+
+
+def _refund(state: State, window_no: int, counted_in: int) -> State:
+    # take back one hit counted in window counted_in, state already advanced to window_no
+    _, current, previous = state
+    if counted_in == window_no:
+        return window_no, max(current - 1, 0), previous
+    if counted_in == window_no - 1:
+        return window_no, current, max(previous - 1, 0)
+    return state  # already out of the sliding window
+
+
+def _decide(state: State, now: float, window: float, limit: int) -> Tuple[bool, int, State]:
+    """(allowed, retry after seconds, new state) for one attempt."""
+    window_no, current, previous = state
+    elapsed = now - window_no * window
+    weight = 1.0 - elapsed / window
+    if previous * weight + current < limit:
+        return True, 0, (window_no, current + 1, previous)
+
+    # when the weighted count drops below the limit again
+    if current >= limit:
+        # not before the next window, and then this window's hits have to fade out enough
+        wait = window - elapsed + window * (1.0 - limit / current)
+    else:
+        wait = window * (1.0 - (limit - current) / previous) - elapsed
+    return False, max(1, math.ceil(wait)), state
+
+
+class MemoryBackend:
+    def __init__(self) -> None:
+        self._states: Dict[str, State] = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.monotonic()
+
+    def hit(self, key: str, window: float, limit: int) -> Tuple[bool, int]:
+        now = time.time()
+        window_no = int(now // window)
+        with self._lock:
+            self._maybe_evict(window_no)
+            allowed, retry_after, state = _decide(_advance(self._states.get(key), window_no), now, window, limit)
+            self._states[key] = state
+        return allowed, retry_after
+
+    def refund(self, key: str, window: float, counted_at: float) -> None:
+        window_no = int(time.time() // window)
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states[key] = _refund(_advance(state, window_no), window_no, int(counted_at // window))
+
+    def _maybe_evict(self, window_no: int) -> None:
+        if time.monotonic() - self._last_evict < EVICT_EVERY_SECONDS:
+            return
+        self._last_evict = time.monotonic()
+        # keys untouched for two windows count as zero anyway
+        stale = [key for key, (stored_no, _, _) in self._states.items() if stored_no < window_no - 1]
+        for key in stale:
+            del self._states[key]
+
+
+class SQLiteBackend:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._last_evict = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                " key TEXT PRIMARY KEY, window_no INTEGER NOT NULL, current INTEGER NOT NULL, previous INTEGER NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)  # transactions by hand
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, window: float, limit: int) -> Tuple[bool, int]:
+        now = time.time()
+        window_no = int(now // window)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT window_no, current, previous FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            allowed, retry_after, state = _decide(_advance(row, window_no), now, window, limit)
+            conn.execute("INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?)", (key, *state))
+            if now - self._last_evict >= EVICT_EVERY_SECONDS:
+                self._last_evict = now
+                conn.execute("DELETE FROM rate_limits WHERE window_no < ?", (window_no - 1,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def refund(self, key: str, window: float, counted_at: float) -> None:
+        window_no = int(time.time() // window)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT window_no, current, previous FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                state = _refund(_advance(row, window_no), window_no, int(counted_at // window))
+                conn.execute("INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?)", (key, *state))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _make_backend():
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteBackend(settings.RATE_LIMIT_SQLITE_PATH)
+    return MemoryBackend()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _make_backend()
+        return _backend
+
+
+def _login_limits(ip: Optional[str], email: str) -> List[Tuple[str, int]]:
+    checks = [(f"login:email:{email.strip().lower()}", settings.RATE_LIMIT_LOGIN_PER_EMAIL)]
+    if ip:
+        checks.insert(0, (f"login:ip:{ip}", settings.RATE_LIMIT_LOGIN_PER_IP))
+    return [(key, limit) for key, limit in checks if limit > 0]
+
+
+def check_login(ip: Optional[str], email: str) -> float:
+    """
+    Count a login attempt; raises RateLimited when the IP or the email is over its limit.
+    Returns when it was counted, for login_succeeded().
+    """
+    backend = get_backend()
+    window = settings.RATE_LIMIT_LOGIN_WINDOW_SECONDS
+    counted_at = time.time()
+    for key, limit in _login_limits(ip, email):
+        allowed, retry_after = backend.hit(key, window, limit)
+        if not allowed:
+            raise RateLimited(retry_after)
+    return counted_at
+
+
+def login_succeeded(ip: Optional[str], email: str, counted_at: float) -> None:
+    """The attempt counted by check_login() had the right password: it doesn't count against the limits."""
+    backend = get_backend()
+    window = settings.RATE_LIMIT_LOGIN_WINDOW_SECONDS
+    for key, _ in _login_limits(ip, email):
+        backend.refund(key, window, counted_at)
@@ -0,0 +1,96 @@
+"""
+Trail rating aggregates.
+
+add_review keeps Trail.rating_sum / ratings_count / avg_rating up to date incrementally in the
+same transaction as the review insert (see apply_new_rating). This module also has the
+reconciliation job that checks those running totals against the reviews table in bulk and
+fixes trails that drifted (rows edited by hand, reviews removed directly in the DB, ...).
+
+Trails from the populate scripts come with a seeded ratings_count but no review rows, so a
+trail with more ratings than reviews is treated as seeded and only checked for consistency.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Review, Trail
+from app.services.changes import log_changes, trail_updates
+
+logger = logging.getLogger(__name__)
+
+
+def apply_new_rating(trail: Trail, rating: int) -> None:
+    """
+    Adds one rating to the trail's aggregates as SQL expressions, so the UPDATE is computed
+    by the DB from the current row (no lost updates when two reviews land at once).
+    """
+    trail.rating_sum = Trail.rating_sum + rating
+    trail.ratings_count = Trail.ratings_count + 1
+    trail.avg_rating = func.round((Trail.rating_sum + rating) * 1.0 / (Trail.ratings_count + 1), 2)
+
+
+def reconcile_trail_ratings(db: Session) -> Dict[str, int]:
+    """
+    Compare every trail's aggregates with its reviews (one GROUP BY) and fix the ones that are off.
+    Returns {"checked": ..., "fixed": ...}.
+    """
+    per_trail = (
+        select(
+            Review.trail_id,
+            func.count(Review.id).label("n"),
+            func.sum(Review.rating).label("total"),
+        )
+        .group_by(Review.trail_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(
+            Trail.id,
+            Trail.ratings_count,
+            Trail.rating_sum,
+            Trail.avg_rating,
+            func.coalesce(per_trail.c.n, 0),
+            func.coalesce(per_trail.c.total, 0),
+        ).outerjoin(per_trail, per_trail.c.trail_id == Trail.id)
+    ).all()
+
+    fixes = []
+    for trail_id, count, total, avg, review_count, review_total in rows:
+        want_count, want_total = count or 0, total or 0
+        if want_count <= review_count:
+            # fully backed by reviews: the reviews are the source of truth
+            want_count, want_total = review_count, review_total
+        want_avg = round(want_total / want_count, 2) if want_count else 0.0
+
+        if want_count != count or abs(want_total - total) > 1e-6 or abs((avg or 0) - want_avg) > 0.005:
+            fixes.append({"id": trail_id, "ratings_count": want_count, "rating_sum": want_total, "avg_rating": want_avg})
+
+    if fixes:
+        db.execute(update(Trail), fixes)  # bulk UPDATE by primary key
+        log_changes(db.connection(), trail_updates(f["id"] for f in fixes))  # bulk updates skip the ORM hooks
+        db.commit()
+        logger.warning("Rating reconciliation fixed %d of %d trails", len(fixes), len(rows))
+    return {"checked": len(rows), "fixed": len(fixes)}
+
+
+def start_reconciler(session_factory, interval_minutes: float) -> threading.Thread | None:
+    """Run reconcile_trail_ratings every interval_minutes in a daemon thread (0 turns it off)."""
+    if interval_minutes <= 0:
+        return None
+    def loop() -> None:
+        while True:
+            time.sleep(interval_minutes * 60)
+            try:
+                with session_factory() as db:
+                    reconcile_trail_ratings(db)
+            except Exception:
+                logger.exception("Rating reconciliation failed")
+
+    thread = threading.Thread(target=loop, name="ratings-reconciler", daemon=True)
+    thread.start()
+    return thread
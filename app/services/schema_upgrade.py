@@ -0,0 +1,96 @@
+"""
+Brings an existing database up to the current models.
+
+create_all only creates tables that are missing, it never touches a table that already exists.
+So columns added to an existing model after a database was first created are added here
+(ALTER TABLE ... ADD COLUMN, filled once right after they're added), and then every index of
+the models is created if it isn't there yet. SQLite can't add a column whose default isn't a
+constant (CURRENT_TIMESTAMP) to a table with rows, so there the table is rebuilt instead.
+
+Every step checks the current schema first, so this is safe to run on every startup, right
+after create_all and before anything reads the new columns.
+"""
+
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from app import models  # puts the model tables on Base.metadata
+from app.config import settings
+from app.db import Base
+
+# (table, column, DDL after the column type, SQL filling existing rows or None)
+# the column type comes from the model
+ADDED_COLUMNS: List[Tuple[str, str, str, Optional[str]]] = [
+    ("trails", "geo_cell", "", None),  # filled by geo.backfill_trail_cells
+    # avg is rounded to 2 decimals, so this is close; the ratings reconciler makes it exact
+    ("trails", "rating_sum", "NOT NULL DEFAULT 0",
+     "UPDATE trails SET rating_sum = COALESCE(avg_rating, 0) * COALESCE(ratings_count, 0)"),
+    # when old reviews were written is unknown, they get the time of the upgrade
+    ("reviews", "created_at", "NOT NULL DEFAULT CURRENT_TIMESTAMP", None),
+    # photos uploaded before streaming have no hash/size, the code treats NULL as unknown
+    ("photos", "content_hash", "", None),
+    ("photos", "size_bytes", "", None),
+    ("photos", "variants", "", None),  # NULL = serve the original for every size
+    ("users", "followers_count", "NOT NULL DEFAULT 0",
+     "UPDATE users SET followers_count = (SELECT COUNT(*) FROM follows WHERE follows.followee_id = users.id)"),
+    # posts of accounts over the fan-out limit were never copied into timelines
+    ("posts", "fanned_out", "NOT NULL DEFAULT TRUE",
+     "UPDATE posts SET fanned_out = FALSE WHERE user_id IN "
+     f"(SELECT id FROM users WHERE followers_count > {int(settings.FEED_FANOUT_MAX_FOLLOWERS)})"),
+]
+
+SQLITE_NON_CONSTANT_DEFAULTS = ("CURRENT_TIMESTAMP", "CURRENT_DATE", "CURRENT_TIME")
+
+# page cursor keys: SQLite keeps datetimes as text, and rows from the CURRENT_TIMESTAMP default
+# ("2024-05-01 12:00:00") have to get the fractions SQLAlchemy writes and binds
+# ("2024-05-01 12:00:00.000000") or they compare wrong against a cursor value
+SQLITE_CURSOR_DATETIMES = [("posts", "created_at"), ("reviews", "created_at")]
+
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    """Add missing columns and indexes. Returns the columns that were added, as table.column."""
+    added = []
+    with engine.begin() as conn:
+        for table_name, column_name, ddl, backfill in ADDED_COLUMNS:
+            if _add_column(conn, table_name, column_name, ddl):
+                if backfill:
+                    conn.execute(text(backfill))
+                added.append(f"{table_name}.{column_name}")
+
+        if conn.dialect.name == "sqlite":
+            for table_name, column_name in SQLITE_CURSOR_DATETIMES:
+                conn.execute(text(
+                    f"UPDATE {table_name} SET {column_name} = {column_name} || '.000000' WHERE length({column_name}) = 19"
+                ))
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return added
+
+
+def _add_column(conn: Connection, table_name: str, column_name: str, ddl: str) -> bool:
+    existing = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return False
+    if conn.dialect.name == "sqlite" and any(d in ddl for d in SQLITE_NON_CONSTANT_DEFAULTS):
+        _rebuild_sqlite_table(conn, table_name, existing)
+        return True
+    column = Base.metadata.tables[table_name].c[column_name]
+    col_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {col_type} {ddl}".rstrip()))
+    return True
+
+
+def _rebuild_sqlite_table(conn: Connection, table_name: str, existing: Set[str]) -> None:
+    # new table as the model defines it, copy the old rows over, swap; indexes follow in upgrade_schema
+    table = Base.metadata.tables[table_name]
+    create = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(create.replace(f"CREATE TABLE {table_name} (", f"CREATE TABLE {table_name}_new (", 1)))
+    columns = ", ".join(c.name for c in table.columns if c.name in existing)
+    conn.execute(text(f"INSERT INTO {table_name}_new ({columns}) SELECT {columns} FROM {table_name}"))
+    conn.execute(text(f"DROP TABLE {table_name}"))
+    conn.execute(text(f"ALTER TABLE {table_name}_new RENAME TO {table_name}"))
@@ -0,0 +1,132 @@
+"""
+Full text search for trails.
+
+On SQLite we keep an FTS5 table (trails_fts) with one row per trail: the trail name, its park
+name and the park state, rowid = trail id. Triggers on trails/parks keep it in sync, so every
+write path (API, NPS import, populate scripts) updates it without extra code.
+
+search_trail_ids() turns the user's text into a prefix query ("ramb lo" -> "ramb"* "lo"*) and
+returns trail ids ranked by BM25, with name matches weighted above park/state matches.
+If FTS5 is not available (or the DB is not SQLite) it returns None and callers fall back to LIKE.
+"""
+
+import re
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# column weights for bm25(): name, park_name, state
+BM25_WEIGHTS = (10.0, 3.0, 1.0)
+
+_PARK_NAME = "(SELECT name FROM parks WHERE id = new.park_id)"
+_PARK_STATE = "(SELECT state FROM parks WHERE id = new.park_id)"
+
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS trails_fts USING fts5(
+        name, park_name, state, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trails_fts_ai AFTER INSERT ON trails BEGIN
+        INSERT INTO trails_fts(rowid, name, park_name, state)
+        VALUES (new.id, new.name, {_PARK_NAME}, {_PARK_STATE});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trails_fts_au AFTER UPDATE OF name, park_id ON trails BEGIN
+        DELETE FROM trails_fts WHERE rowid = old.id;
+        INSERT INTO trails_fts(rowid, name, park_name, state)
+        VALUES (new.id, new.name, {_PARK_NAME}, {_PARK_STATE});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trails_fts_ad AFTER DELETE ON trails BEGIN
+        DELETE FROM trails_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS parks_fts_au AFTER UPDATE OF name, state ON parks BEGIN
+        UPDATE trails_fts SET park_name = new.name, state = new.state
+        WHERE rowid IN (SELECT id FROM trails WHERE park_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS parks_fts_ad AFTER DELETE ON parks BEGIN
+        UPDATE trails_fts SET park_name = NULL, state = NULL
+        WHERE rowid IN (SELECT id FROM trails WHERE park_id = old.id);
+    END
+    """,
+]
+
+_fts_enabled = False
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """
+    Create the FTS table + triggers if needed and (re)fill the table when it is out of step
+    with trails (first run, or rows written before the triggers existed).
+    Returns whether FTS search is available.
+    """
+    global _fts_enabled
+    if engine.dialect.name != "sqlite":
+        _fts_enabled = False
+        return False
+
+    try:
+        with engine.begin() as conn:
+            for ddl in SEARCH_INDEX_DDL:
+                conn.execute(text(ddl))
+
+            indexed = conn.execute(text("SELECT COUNT(*) FROM trails_fts")).scalar()
+            total = conn.execute(text("SELECT COUNT(*) FROM trails")).scalar()
+            if indexed != total:
+                conn.execute(text("DELETE FROM trails_fts"))
+                conn.execute(text(
+                    """
+                    INSERT INTO trails_fts(rowid, name, park_name, state)
+                    SELECT t.id, t.name, p.name, p.state
+                    FROM trails t LEFT JOIN parks p ON p.id = t.park_id
+                    """
+                ))
+    except OperationalError:
+        # SQLite was built without FTS5
+        _fts_enabled = False
+        return False
+
+    _fts_enabled = True
+    return True
+
+
+def to_match_query(q: str) -> Optional[str]:
+    # every word becomes a quoted prefix term, so user input can't inject FTS syntax
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_trail_ids(db: Session, q: str, limit: int) -> Optional[List[int]]:
+    """Trail ids matching q, best BM25 match first. None means FTS can't be used here."""
+    if not _fts_enabled:
+        return None
+    match = to_match_query(q)
+    if match is None:
+        return []
+
+    w_name, w_park, w_state = BM25_WEIGHTS
+    rows = db.execute(
+        text(
+            f"""
+            SELECT rowid FROM trails_fts
+            WHERE trails_fts MATCH :match
+            ORDER BY bm25(trails_fts, {w_name}, {w_park}, {w_state})
+            LIMIT :limit
+            """
+        ),
+        {"match": match, "limit": limit},
+    )
+    return [r[0] for r in rows]
@@ -0,0 +1,180 @@
+"""
+Offline map tile packs.
+
+The map tiles come from a base map extract on the server (an MBTiles file, settings.BASEMAP_MBTILES,
+raster or vector, whatever the app renders). For a saved trail we copy the tiles covering the
+trail plus TILE_PACK_BUFFER_KM around it, for zooms TILE_PACK_MIN_ZOOM..TILE_PACK_MAX_ZOOM,
+into a small MBTiles file of its own that the app downloads in one go and opens with its
+offline map view.
+
+Trails only have a start point, so the covered area is a circle around it of the buffer plus
+half the trail's length. Packs don't depend on the user, so one pack per trail is shared by
+everyone who saved it; the file name carries a fingerprint of everything that goes into it
+(trail position and length, zoom range, base map file), so a moved trail or a new base map
+makes a new pack and the old one is dropped.
+
+Building reads and writes SQLite files, so it runs as a background task after the trail is
+saved (see toggle_offline_trail), never inside a request.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+import threading
+from math import cos, log, pi, radians, tan
+from typing import Iterator, Optional, Tuple
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import Trail
+from app.services.geo import bounding_box
+
+logger = logging.getLogger(__name__)
+
+PACK_ROOT = pathlib.Path("tilepacks")
+MAX_LAT = 85.05112878  # web mercator cuts off here
+
+_building: set[int] = set()
+_building_lock = threading.Lock()
+
+
+def _tile_x(lon: float, zoom: int) -> int:
+    n = 1 << zoom
+    return min(int((lon + 180.0) / 360.0 * n), n - 1)
+
+
+def _tile_y(lat: float, zoom: int) -> int:
+    # XYZ numbering (0 = north); MBTiles rows count from the south
+    n = 1 << zoom
+    lat = max(min(lat, MAX_LAT), -MAX_LAT)
+    r = radians(lat)
+    return min(max(int((1.0 - log(tan(r) + 1.0 / cos(r)) / pi) / 2.0 * n), 0), n - 1)
+
+
+def _tile_ranges(lat: float, lon: float, radius_km: float, zoom: int) -> Iterator[Tuple[int, int, int, int]]:
+    # (x_lo, x_hi, row_lo, row_hi) in MBTiles (TMS) numbering, two ranges across the antimeridian
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    n = 1 << zoom
+    row_lo = n - 1 - _tile_y(min_lat, zoom)
+    row_hi = n - 1 - _tile_y(max_lat, zoom)
+    if min_lon <= max_lon:
+        yield _tile_x(min_lon, zoom), _tile_x(max_lon, zoom), row_lo, row_hi
+    else:
+        yield _tile_x(min_lon, zoom), n - 1, row_lo, row_hi
+        yield 0, _tile_x(max_lon, zoom), row_lo, row_hi
+
+
+def _area(trail: Trail) -> Tuple[float, float, float]:
+    return trail.lat, trail.lon, settings.TILE_PACK_BUFFER_KM + (trail.length_km or 0) / 2
+
+
+def _fingerprint(trail: Trail, basemap: pathlib.Path) -> str:
+    stat = basemap.stat()
+    parts = (
+        *_area(trail),
+        settings.TILE_PACK_MIN_ZOOM,
+        settings.TILE_PACK_MAX_ZOOM,
+        str(basemap.resolve()),
+        stat.st_size,
+        stat.st_mtime_ns,
+    )
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:16]
+
+
+def _basemap() -> Optional[pathlib.Path]:
+    if not settings.BASEMAP_MBTILES:
+        return None
+    path = pathlib.Path(settings.BASEMAP_MBTILES)
+    return path if path.is_file() else None
+
+
+def pack_path(trail: Trail) -> Optional[pathlib.Path]:
+    """Where the trail's current pack is (or will be) stored, None if packs can't be made for it."""
+    basemap = _basemap()
+    if basemap is None or trail.lat is None or trail.lon is None:
+        return None
+    return PACK_ROOT / f"{trail.id}-{_fingerprint(trail, basemap)}.mbtiles"
+
+
+def is_building(trail_id: int) -> bool:
+    return trail_id in _building
+
+
+def _write_pack(trail: Trail, basemap: pathlib.Path, dest: pathlib.Path) -> int:
+    lat, lon, radius_km = _area(trail)
+    fd, tmp_path = tempfile.mkstemp(dir=dest.parent, suffix=".part")
+    os.close(fd)
+    copied = 0
+    try:
+        src = sqlite3.connect(f"file:{basemap}?mode=ro", uri=True)
+        out = sqlite3.connect(tmp_path)
+        try:
+            out.executescript(
+                """
+                CREATE TABLE metadata (name TEXT, value TEXT);
+                CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+                CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+                """
+            )
+            meta = dict(src.execute("SELECT name, value FROM metadata"))
+            min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+            meta.update({
+                "name": f"{meta.get('name', 'basemap')} - {trail.name}",
+                "bounds": f"{min_lon},{min_lat},{max_lon},{max_lat}",
+                "center": f"{lon},{lat},{settings.TILE_PACK_MIN_ZOOM}",
+                "minzoom": str(settings.TILE_PACK_MIN_ZOOM),
+                "maxzoom": str(settings.TILE_PACK_MAX_ZOOM),
+            })
+            out.executemany("INSERT INTO metadata VALUES (?, ?)", meta.items())
+
+            for zoom in range(settings.TILE_PACK_MIN_ZOOM, settings.TILE_PACK_MAX_ZOOM + 1):
+                for x_lo, x_hi, row_lo, row_hi in _tile_ranges(lat, lon, radius_km, zoom):
+                    rows = src.execute(
+                        "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"
+                        " WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+                        (zoom, x_lo, x_hi, row_lo, row_hi),
+                    )
+                    before = out.total_changes
+                    out.executemany("INSERT OR IGNORE INTO tiles VALUES (?, ?, ?, ?)", rows)
+                    copied += out.total_changes - before
+            out.commit()
+        finally:
+            src.close()
+            out.close()
+        os.replace(tmp_path, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return copied
+
+
+def build_tile_pack(trail_id: int) -> None:
+    """Make the trail's pack if it isn't there yet. Safe to call repeatedly (runs as a background task)."""
+    with _building_lock:
+        if trail_id in _building:
+            return
+        _building.add(trail_id)
+    try:
+        with SessionLocal() as db:
+            trail = db.get(Trail, trail_id)
+            dest = pack_path(trail) if trail else None
+            if dest is None or dest.exists():
+                return
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            copied = _write_pack(trail, _basemap(), dest)
+            logger.info("Tile pack for trail %s: %d tiles", trail_id, copied)
+
+        for old in PACK_ROOT.glob(f"{trail_id}-*.mbtiles"):
+            if old != dest:
+                old.unlink(missing_ok=True)
+    except Exception:
+        logger.exception("Could not build the tile pack for trail %s", trail_id)
+    finally:
+        with _building_lock:
+            _building.discard(trail_id)
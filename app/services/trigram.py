@@ -0,0 +1,152 @@
+"""
+Typo tolerant name search with trigrams (same idea as Postgres pg_trgm).
+
+Each name is lowercased, split into words and every word is padded ("  rambel ") and cut
+into 3 letter pieces. Two texts are similar when they share a large part of their pieces:
+similarity = shared / (all pieces of both). A name is scored by its best matching run of as
+many words as the query has (like pg_trgm's word_similarity), or by the whole name if that is
+better, so "yosemete" finds "Yosemite National Park" and "Rambel Trail" finds "Ramble Trail".
+
+The indexes live in memory (one for trail names, one for park names), are built at startup
+and follow trail/park inserts, renames and deletes through ORM hooks once they commit.
+"""
+
+import math
+import re
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Park, Trail
+from app.services.after_commit import on_commit
+
+SIMILARITY_THRESHOLD = 0.3  # pg_trgm's default
+
+
+def word_trigrams(text: str) -> Tuple[FrozenSet[str], ...]:
+    """Trigrams of each word of text, in order."""
+    words = []
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f"  {word} "
+        words.append(frozenset(padded[i:i + 3] for i in range(len(padded) - 2)))
+    return tuple(words)
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    return frozenset().union(*word_trigrams(text))
+
+
+def _similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class TrigramIndex:
+    def __init__(self) -> None:
+        self._grams: Dict[int, FrozenSet[str]] = {}  # id -> trigrams of its name
+        self._words: Dict[int, Tuple[FrozenSet[str], ...]] = {}  # id -> trigrams of each word of its name
+        self._postings: Dict[str, Set[int]] = {}  # trigram -> ids whose name has it
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def build(self, items: Iterable[Tuple[int, str]]) -> None:
+        grams: Dict[int, FrozenSet[str]] = {}
+        words: Dict[int, Tuple[FrozenSet[str], ...]] = {}
+        postings: Dict[str, Set[int]] = {}
+        for item_id, name in items:
+            words[item_id] = word_trigrams(name or "")
+            g = grams[item_id] = frozenset().union(*words[item_id])
+            for gram in g:
+                postings.setdefault(gram, set()).add(item_id)
+        with self._lock:
+            self._grams, self._words, self._postings = grams, words, postings
+
+    def add(self, item_id: int, name: str) -> None:
+        with self._lock:
+            self._remove(item_id)
+            self._words[item_id] = word_trigrams(name or "")
+            g = self._grams[item_id] = frozenset().union(*self._words[item_id])
+            for gram in g:
+                self._postings.setdefault(gram, set()).add(item_id)
+
+    def remove(self, item_id: int) -> None:
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id: int) -> None:
+        self._words.pop(item_id, None)
+        for gram in self._grams.pop(item_id, ()):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def search(self, q: str, limit: int, threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[int, float]]:
+        """(id, similarity) of names at least `threshold` similar to q, most similar first."""
+        query_words = word_trigrams(q)
+        query = frozenset().union(*query_words)
+        if not query:
+            return []
+
+        with self._lock:
+            # A name (or run of its words) reaching the threshold shares at least `needed` of the
+            # query's trigrams, so it must show up in one of the (len(query) - needed + 1) rarest
+            # ones. Common pieces like " tr"/"ail" never have to be walked.
+            needed = max(1, math.ceil(threshold * len(query)))
+            rarest = sorted(query, key=lambda gram: len(self._postings.get(gram, ())))
+            candidates: Set[int] = set()
+            for gram in rarest[: len(query) - needed + 1]:
+                candidates.update(self._postings.get(gram, ()))
+
+            scored: List[Tuple[int, float]] = []
+            span = len(query_words)
+            for item_id in candidates:
+                score = _similarity(query, self._grams[item_id])
+                words = self._words[item_id]
+                for start in range(len(words) - span + 1 if len(words) > span else 0):
+                    score = max(score, _similarity(query, frozenset().union(*words[start:start + span])))
+                if score >= threshold:
+                    scored.append((item_id, score))
+
+        scored.sort(key=lambda pair: (-pair[1], pair[0]))
+        return scored[:limit]
+
+
+trail_names = TrigramIndex()
+park_names = TrigramIndex()
+
+
+def build_name_indexes(db: Session) -> None:
+    trail_names.build(db.query(Trail.id, Trail.name).all())
+    park_names.build(db.query(Park.id, Park.name).all())
+
+
+# keep the indexes in step with writes made through the ORM, once they commit
+def _track(model, index: TrigramIndex, key: str) -> None:
+    # the values are taken at flush time, the last change to a row in a transaction wins
+    def _index_name(target) -> None:
+        item_id, name = target.id, target.name
+        on_commit(target, (key, item_id), lambda: index.add(item_id, name))
+
+    @event.listens_for(model, "after_insert")
+    def _added(mapper, connection, target) -> None:
+        _index_name(target)
+
+    @event.listens_for(model, "after_update")
+    def _updated(mapper, connection, target) -> None:
+        if inspect(target).attrs.name.history.has_changes():
+            _index_name(target)
+
+    @event.listens_for(model, "after_delete")
+    def _removed(mapper, connection, target) -> None:
+        item_id = target.id
+        on_commit(target, (key, item_id), lambda: index.remove(item_id))
+
+
+_track(Trail, trail_names, "trigram.trails")
+_track(Park, park_names, "trigram.parks")
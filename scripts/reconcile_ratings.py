@@ -0,0 +1,23 @@
+"""
+Script to check every trail's rating totals against its reviews and fix the ones that drifted.
+The API runs the same check in the background (RATINGS_RECONCILE_MINUTES), this is for doing it by hand.
+
+example is: python3 -m scripts.reconcile_ratings
+and it prints something like: Rating reconciliation: {'checked': 57, 'fixed': 0}
+"""
+
+from app.db import SessionLocal
+from app.services.ratings import reconcile_trail_ratings
+
+
+def main():
+    db = SessionLocal()
+    try:
+        result = reconcile_trail_ratings(db)
+        print(f"Rating reconciliation: {result}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
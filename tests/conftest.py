@@ -0,0 +1,15 @@
+"""
+Test setup: the app reads DATABASE_URL when app.db is imported, so point it at a throwaway
+SQLite file before any test module imports the app.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="trailblazer-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
@@ -0,0 +1,52 @@
+"""
+GET /posts/ loads each post's author from the same query (contains_eager), so the number of SQL
+statements per page must not grow with the page size.
+"""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.db import Base, SessionLocal, engine
+from app.models import Post, User
+from app.routers import posts
+
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        authors = [User(email=f"author{i}@example.com", password_hash="x", display_name=f"Author {i}") for i in range(5)]
+        db.add_all(authors)
+        db.flush()
+        for i in range(40):
+            db.add(Post(user_id=authors[i % len(authors)].id, body=f"post {i}"))
+        db.commit()
+
+    app = FastAPI()
+    app.include_router(posts.router)
+    return TestClient(app)
+
+
+def count_statements(client, **params) -> int:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get("/posts/", params=params)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    assert response.status_code == 200
+    assert len(response.json()) == params["limit"]
+    assert all(post["display_name"].startswith("Author ") for post in response.json())
+    return len(statements)
+
+
+def test_list_posts_statement_count_does_not_grow_with_page_size(client):
+    counts = {limit: count_statements(client, limit=limit) for limit in (1, 5, 25)}
+    assert len(set(counts.values())) == 1, counts
@@ -0,0 +1,52 @@
+"""
+Fuzzy name search: one mistyped word has to find a longer name, and the shared indexes only
+change once the write that changed a name has committed.
+"""
+
+from app.db import Base, SessionLocal, engine
+from app.models import Park
+from app.services.trigram import TrigramIndex, park_names
+
+
+def index_of(*names: str) -> TrigramIndex:
+    index = TrigramIndex()
+    index.build(enumerate(names, start=1))
+    return index
+
+
+def test_one_mistyped_word_finds_a_multi_word_name():
+    index = index_of("Yosemite National Park", "Harriman State Park", "Ramble Trail", "Ramble", "Bear Mountain")
+    assert [i for i, _ in index.search("yosemete", 5)] == [1]
+    assert [i for i, _ in index.search("harimann", 5)] == [2]
+    assert {i for i, _ in index.search("Rambel", 5)} == {3, 4}
+    assert [i for i, _ in index.search("Rambel Trail", 5)][0] == 3
+
+
+def test_unrelated_query_matches_nothing():
+    assert index_of("Yosemite National Park").search("zzzz", 5) == []
+
+
+def test_index_follows_committed_writes_only():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        park = Park(name="Shenandoah National Park", state="VA")
+        db.add(park)
+        db.flush()
+        db.rollback()
+        assert park_names.search("shenandoa", 5) == []
+
+        park = Park(name="Shenandoah National Park", state="VA")
+        db.add(park)
+        db.commit()
+        park_id = park.id
+        assert [i for i, _ in park_names.search("shenandoa", 5)] == [park_id]
+
+        db.delete(park)
+        db.flush()
+        db.rollback()
+        assert [i for i, _ in park_names.search("shenandoa", 5)] == [park_id]
+
+        park = db.get(Park, park_id)
+        db.delete(park)
+        db.commit()
+        assert park_names.search("shenandoa", 5) == []